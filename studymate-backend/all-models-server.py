@@ -14,39 +14,27 @@ import time
 import logging
 import tempfile
 import shutil
+import hashlib
+import gzip
+from collections import deque, OrderedDict
 from datetime import datetime
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Union, AsyncIterator, Tuple
 import uuid
-import requests
+import httpx
 from dotenv import load_dotenv
+from token_counter import TokenCounter
+from pdf_extraction import PDF_AVAILABLE, PDF_LIBRARY, extract_pdf_text
 import asyncio
+import multiprocessing
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
 
 # Load environment variables
 load_dotenv()
 
-# PDF processing
-try:
-    import fitz  # PyMuPDF
-    PDF_AVAILABLE = True
-    print("✅ PyMuPDF available for PDF processing")
-except ImportError:
-    try:
-        import pdfplumber
-        PDF_AVAILABLE = True
-        print("✅ Using pdfplumber for PDF processing")
-    except ImportError:
-        PDF_AVAILABLE = False
-        print("⚠️ No PDF processing library available")
-
-# AI and ML imports
-try:
-    from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
-    import torch
-    HF_AVAILABLE = True
-    print("✅ Hugging Face transformers available")
-except ImportError:
-    HF_AVAILABLE = False
-    print("⚠️ Hugging Face transformers not available")
+# Spawned extraction workers re-run this script's top level, so check for
+# transformers without importing it (and torch with it)
+HF_AVAILABLE = importlib.util.find_spec("transformers") is not None
 
 # Setup logging
 logging.basicConfig(
@@ -78,88 +66,461 @@ HUGGINGFACE_API_KEY = os.getenv("HUGGINGFACE_API_KEY", "")
 HUGGINGFACE_API_URL = os.getenv("HUGGINGFACE_API_URL", "https://api-inference.huggingface.co/models/ibm-granite/granite-3.3-2b-instruct")
 VLLM_BASE_URL = os.getenv("VLLM_BASE_URL", "http://localhost:8000")
 
-# Global variables for loaded models
-loaded_models = {}
-document_store = {}
+# Per-provider connection pool size and request timeout (seconds)
+PROVIDER_LIMITS = {
+    "deepseek": {
+        "max_connections": int(os.getenv("DEEPSEEK_MAX_CONNECTIONS", "20")),
+        "timeout": float(os.getenv("DEEPSEEK_TIMEOUT", "30"))
+    },
+    "huggingface": {
+        "max_connections": int(os.getenv("HUGGINGFACE_MAX_CONNECTIONS", "10")),
+        "timeout": float(os.getenv("HUGGINGFACE_TIMEOUT", "30"))
+    },
+    "vllm": {
+        "max_connections": int(os.getenv("VLLM_MAX_CONNECTIONS", "50")),
+        "timeout": float(os.getenv("VLLM_TIMEOUT", "30"))
+    }
+}
+PROVIDER_CONNECT_TIMEOUT = float(os.getenv("PROVIDER_CONNECT_TIMEOUT", "5"))
+
+# Provider routing: EWMA smoothing, and the circuit breaker opens after this many
+# consecutive failures for ROUTER_OPEN_SECONDS before a single probe is let through
+ROUTER_EWMA_ALPHA = float(os.getenv("ROUTER_EWMA_ALPHA", "0.3"))
+ROUTER_FAILURE_THRESHOLD = int(os.getenv("ROUTER_FAILURE_THRESHOLD", "3"))
+ROUTER_OPEN_SECONDS = float(os.getenv("ROUTER_OPEN_SECONDS", "30"))
+ROUTER_ERROR_PENALTY = float(os.getenv("ROUTER_ERROR_PENALTY", "4"))
+
+# Hedged requests: if the first provider is slower than its HEDGE_PERCENTILE
+# latency, the request is also sent to the next provider and the first answer wins
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "3"))
+HEDGE_BUDGET_PER_MINUTE = int(os.getenv("HEDGE_BUDGET_PER_MINUTE", "30"))
+
+# Map-reduce summarisation: characters of chunk text per map call, concurrent
+# model calls per document, and partial summaries combined per reduce call
+SUMMARY_GROUP_CHARS = int(os.getenv("SUMMARY_GROUP_CHARS", "8000"))
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+SUMMARY_REDUCE_FANIN = int(os.getenv("SUMMARY_REDUCE_FANIN", "4"))
+SUMMARY_PARTIAL_TOKENS = int(os.getenv("SUMMARY_PARTIAL_TOKENS", "400"))
+# Retries of a failed map or reduce call; a section that still fails is
+# represented by an excerpt of its text this long instead of failing the request
+SUMMARY_RETRIES = int(os.getenv("SUMMARY_RETRIES", "1"))
+SUMMARY_EXCERPT_CHARS = int(os.getenv("SUMMARY_EXCERPT_CHARS", "1500"))
+
+# Summary cache: entries kept in memory, and directory for the disk tier ("" disables it).
+# The disk tier drops its least recently used files beyond the entry and size limits.
+# Bump SUMMARY_PROMPT_VERSION whenever the summarisation prompts change
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "128"))
+SUMMARY_CACHE_DIR = os.getenv("SUMMARY_CACHE_DIR", "summary_cache")
+SUMMARY_CACHE_DISK_ENTRIES = int(os.getenv("SUMMARY_CACHE_DISK_ENTRIES", "2000"))
+SUMMARY_CACHE_DISK_MB = int(os.getenv("SUMMARY_CACHE_DISK_MB", "200"))
+SUMMARY_PROMPT_VERSION = f"mapreduce-v1-{SUMMARY_GROUP_CHARS}-{SUMMARY_REDUCE_FANIN}"
 
-def extract_pdf_text(file_path: str) -> Dict[str, Any]:
-    """Extract text from PDF using PyMuPDF or pdfplumber"""
+# Uploaded documents: memory budget for full documents, where evicted ones spill,
+# and chunks or pages per compressed block of a spill file (the unit read per page request)
+DOCUMENT_STORE_MEMORY_MB = float(os.getenv("DOCUMENT_STORE_MEMORY_MB", "256"))
+DOCUMENT_STORE_DIR = os.getenv("DOCUMENT_STORE_DIR", "document_store")
+DOCUMENT_STORE_BLOCK_ITEMS = int(os.getenv("DOCUMENT_STORE_BLOCK_ITEMS", "64"))
+
+# Tokenizers used for token accounting, by the model label reported in responses
+TOKENIZER_NAMES = {
+    "deepseek-chat": os.getenv("DEEPSEEK_TOKENIZER", "deepseek-ai/DeepSeek-V3"),
+    "ibm-granite": os.getenv("HUGGINGFACE_TOKENIZER", "ibm-granite/granite-3.3-2b-instruct"),
+    "vllm-local": os.getenv("VLLM_TOKENIZER", os.getenv("VLLM_MODEL", "mistralai/Mistral-7B-Instruct-v0.2"))
+}
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "4096"))
+
+# Pagination limits for document chunks and page-range text
+DOCUMENT_CHUNKS_MAX_LIMIT = int(os.getenv("DOCUMENT_CHUNKS_MAX_LIMIT", "200"))
+DOCUMENT_TEXT_MAX_PAGES = int(os.getenv("DOCUMENT_TEXT_MAX_PAGES", "50"))
+
+# PDF extraction runs in worker processes so chat requests are served meanwhile
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "2"))
+PDF_EXTRACT_TIMEOUT = float(os.getenv("PDF_EXTRACT_TIMEOUT", "120"))
+
+SUMMARY_SYSTEM_PROMPT = "You are StudyMate, a helpful AI learning assistant. Provide comprehensive summaries of documents, focusing on key points, main ideas, and important details."
+
+class DocumentStore:
+    """Uploaded documents under a memory budget
+
+    A small metadata index of every document stays in memory; full documents
+    (text and chunks) are kept in an LRU and, when over budget, the least
+    recently used are spilled to disk and loaded back lazily on access.
+    A document larger than the whole budget is spilled as soon as it is stored.
     
-    logger.info(f"Extracting text from PDF: {file_path}")
+    Spill files hold chunks and page texts in independently gzipped blocks,
+    so a page of either is read from disk without loading the document.
+    """
     
-    try:
-        text_chunks = []
-        full_text = ""
-        total_pages = 0
-        
-        # Try PyMuPDF first
-        if 'fitz' in globals():
-            logger.info("Using PyMuPDF for extraction")
-            doc = fitz.open(file_path)
-            total_pages = len(doc)
-            
-            for page_num in range(total_pages):
-                page = doc.load_page(page_num)
-                page_text = page.get_text()
-                full_text += page_text + "\n"
-                
-                # Create chunks of ~1000 characters
-                chunk_size = 1000
-                for i in range(0, len(page_text), chunk_size):
-                    chunk = page_text[i:i + chunk_size].strip()
-                    if chunk:
-                        text_chunks.append({
-                            "content": chunk,
-                            "page": page_num + 1,
-                            "chunk_id": len(text_chunks)
-                        })
-            
-            doc.close()
-            logger.info(f"Extracted {len(full_text)} characters from {total_pages} pages")
-            
-        # Fallback to pdfplumber
-        elif 'pdfplumber' in globals():
-            logger.info("Using pdfplumber for extraction")
-            import pdfplumber
+    METADATA_FIELDS = ("id", "filename", "upload_time", "total_pages", "total_characters")
+    
+    def __init__(self, memory_budget_bytes: int, directory: str, block_items: int):
+        self.memory_budget = memory_budget_bytes
+        self.directory = directory
+        self.block_items = block_items
+        self.metadata = OrderedDict()
+        self.resident = OrderedDict()
+        self.sizes = {}
+        self.resident_bytes = 0
+        self.spilling = {}
+        # doc id -> (offset, length) of the header, chunk and page blocks in its spill file
+        self.spilled = {}
+        self.spills = 0
+        self.loads = 0
+        self.slice_reads = 0
+    
+    def clear_spilled(self):
+        """Remove spill files left by an earlier run (documents only live as long as the process)"""
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name.endswith((".spill", ".tmp")):
+                os.unlink(os.path.join(self.directory, name))
+    
+    @staticmethod
+    def estimate_size(document: Dict[str, Any]) -> int:
+        """Rough in-memory footprint: the text twice (full text and chunks) plus per-chunk overhead"""
+        chunk_bytes = sum(len(chunk["content"]) + 200 for chunk in document.get("chunks", []))
+        return len(document.get("full_text", "")) + chunk_bytes + 1024
+    
+    @staticmethod
+    def page_texts(document: Dict[str, Any], start: int, stop: int) -> List[str]:
+        """Texts of pages start:stop (0-based) of a full document"""
+        full_text = document.get("full_text", "")
+        # Page n spans offsets[n]:offsets[n + 1] of the full text
+        offsets = document.get("page_offsets", []) + [len(full_text)]
+        stop = min(stop, len(offsets) - 1)
+        return [full_text[offsets[page]:offsets[page + 1]] for page in range(start, stop)]
+    
+    def _path(self, doc_id: str) -> str:
+        return os.path.join(self.directory, f"{doc_id}.spill")
+    
+    def _write(self, doc_id: str, document: Dict[str, Any]) -> Dict[str, Any]:
+        """Write a spill file and return its block index"""
+        header = {key: value for key, value in document.items() if key not in ("full_text", "chunks", "page_offsets")}
+        chunks = document.get("chunks", [])
+        pages = self.page_texts(document, 0, len(document.get("page_offsets", [])))
+        
+        index = {"chunks": [], "pages": []}
+        tmp_path = f"{self._path(doc_id)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            def write_block(value: Any) -> Tuple[int, int]:
+                data = gzip.compress(json.dumps(value).encode("utf-8"), compresslevel=6)
+                position = f.tell()
+                f.write(data)
+                return position, len(data)
             
-            with pdfplumber.open(file_path) as pdf:
-                total_pages = len(pdf.pages)
-                for page_num, page in enumerate(pdf.pages):
-                    page_text = page.extract_text() or ""
-                    full_text += page_text + "\n"
-                    
-                    chunk_size = 1000
-                    for i in range(0, len(page_text), chunk_size):
-                        chunk = page_text[i:i + chunk_size].strip()
-                        if chunk:
-                            text_chunks.append({
-                                "content": chunk,
-                                "page": page_num + 1,
-                                "chunk_id": len(text_chunks)
-                            })
+            index["header"] = write_block(header)
+            for kind, items in (("chunks", chunks), ("pages", pages)):
+                for start in range(0, len(items), self.block_items):
+                    index[kind].append(write_block(items[start:start + self.block_items]))
+        os.replace(tmp_path, self._path(doc_id))
+        return index
+    
+    def _read_blocks(self, doc_id: str, blocks: List[Tuple[int, int]]) -> List[Any]:
+        values = []
+        with open(self._path(doc_id), "rb") as f:
+            for position, length in blocks:
+                f.seek(position)
+                values.append(json.loads(gzip.decompress(f.read(length))))
+        return values
+    
+    def _read(self, doc_id: str) -> Dict[str, Any]:
+        index = self.spilled[doc_id]
+        header, *blocks = self._read_blocks(doc_id, [index["header"]] + index["chunks"] + index["pages"])
+        chunks = [chunk for block in blocks[:len(index["chunks"])] for chunk in block]
+        pages = [page for block in blocks[len(index["chunks"]):] for page in block]
         
-        else:
-            raise Exception("No PDF processing library available")
+        page_offsets, position = [], 0
+        for page in pages:
+            page_offsets.append(position)
+            position += len(page)
+        return {**header, "full_text": "".join(pages), "chunks": chunks, "page_offsets": page_offsets}
+    
+    def _read_slice(self, doc_id: str, kind: str, start: int, stop: int) -> List[Any]:
+        """Items start:stop of a spilled document's chunks or pages, reading only their blocks"""
+        if stop <= start:
+            return []
+        first, last = start // self.block_items, (stop - 1) // self.block_items
+        blocks = self._read_blocks(doc_id, self.spilled[doc_id][kind][first:last + 1])
+        items = [item for block in blocks for item in block]
+        base = first * self.block_items
+        return items[start - base:stop - base]
+    
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.metadata
+    
+    def __len__(self) -> int:
+        return len(self.metadata)
+    
+    def _admit(self, doc_id: str, document: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        """Make a document resident; returns the documents evicted to stay in budget"""
+        self.resident[doc_id] = document
+        self.resident.move_to_end(doc_id)
+        if doc_id not in self.sizes:
+            self.sizes[doc_id] = self.estimate_size(document)
+            self.resident_bytes += self.sizes[doc_id]
+        
+        # The new document itself goes too if it alone exceeds the budget
+        evicted = []
+        while self.resident_bytes > self.memory_budget and self.resident:
+            old_id, old_document = self.resident.popitem(last=False)
+            self.resident_bytes -= self.sizes.pop(old_id)
+            evicted.append((old_id, old_document))
+        return evicted
+    
+    async def _spill(self, evicted: List[Tuple[str, Dict[str, Any]]]):
+        # Readers find every evicted document here until its file is complete;
+        # spill files never change, so an existing or in-flight one is reused
+        pending = []
+        for doc_id, document in evicted:
+            if doc_id in self.spilling or doc_id in self.spilled:
+                continue
+            self.spilling[doc_id] = document
+            pending.append((doc_id, document))
+        
+        for doc_id, document in pending:
+            try:
+                self.spilled[doc_id] = await asyncio.to_thread(self._write, doc_id, document)
+                self.spills += 1
+            except Exception as e:
+                # Stay over budget rather than lose the document
+                logger.error(f"Could not spill document {doc_id}: {str(e)}")
+                if doc_id not in self.resident:
+                    self.resident[doc_id] = document
+                    self.resident.move_to_end(doc_id, last=False)
+                    self.sizes[doc_id] = self.estimate_size(document)
+                    self.resident_bytes += self.sizes[doc_id]
+            finally:
+                self.spilling.pop(doc_id, None)
+    
+    async def put(self, doc_id: str, document: Dict[str, Any]):
+        self.metadata[doc_id] = {field: document.get(field) for field in self.METADATA_FIELDS}
+        self.metadata[doc_id]["chunk_count"] = len(document.get("chunks", []))
+        await self._spill(self._admit(doc_id, document))
+    
+    def _in_memory(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        document = self.resident.get(doc_id)
+        if document is not None:
+            self.resident.move_to_end(doc_id)
+            return document
+        return self.spilling.get(doc_id)
+    
+    async def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Full document; loading a spilled one makes it resident again, which can
+        evict and spill others, so a read may also cost a write"""
+        if doc_id not in self.metadata:
+            return None
         
+        document = self.resident.get(doc_id)
+        if document is not None:
+            self.resident.move_to_end(doc_id)
+            return document
+        
+        document = self.spilling.get(doc_id)
+        if document is None:
+            document = await asyncio.to_thread(self._read, doc_id)
+            self.loads += 1
+        await self._spill(self._admit(doc_id, document))
+        return document
+    
+    async def read_chunks(self, doc_id: str, start: int, stop: int) -> Optional[List[Dict[str, Any]]]:
+        """Chunks start:stop, read from the spill file if needed without making the document resident"""
+        if doc_id not in self.metadata:
+            return None
+        document = self._in_memory(doc_id)
+        if document is not None:
+            return document["chunks"][start:stop]
+        self.slice_reads += 1
+        return await asyncio.to_thread(self._read_slice, doc_id, "chunks", start, stop)
+    
+    async def read_pages(self, doc_id: str, start: int, stop: int) -> Optional[List[str]]:
+        """Texts of pages start:stop (0-based), read like read_chunks"""
+        if doc_id not in self.metadata:
+            return None
+        document = self._in_memory(doc_id)
+        if document is not None:
+            return self.page_texts(document, start, stop)
+        self.slice_reads += 1
+        return await asyncio.to_thread(self._read_slice, doc_id, "pages", start, stop)
+    
+    def list_metadata(self) -> List[Dict[str, Any]]:
+        return list(self.metadata.values())
+    
+    def stats(self) -> Dict[str, Any]:
         return {
-            "success": True,
-            "full_text": full_text,
-            "chunks": text_chunks,
-            "total_pages": total_pages,
-            "total_characters": len(full_text)
+            "documents": len(self.metadata),
+            "resident_documents": len(self.resident),
+            "resident_mb": round(self.resident_bytes / (1024 * 1024), 2),
+            "memory_budget_mb": round(self.memory_budget / (1024 * 1024), 2),
+            "spilled_documents": len(self.spilled),
+            "spills": self.spills,
+            "loads": self.loads,
+            "slice_reads": self.slice_reads
         }
-        
-    except Exception as e:
-        logger.error(f"PDF extraction failed: {e}")
+
+# Global variables for loaded models
+loaded_models = {}
+document_store = DocumentStore(int(DOCUMENT_STORE_MEMORY_MB * 1024 * 1024), DOCUMENT_STORE_DIR, DOCUMENT_STORE_BLOCK_ITEMS)
+
+# Shared keep-alive HTTP clients, one connection pool per provider
+http_clients: Dict[str, httpx.AsyncClient] = {}
+
+def get_http_client(provider: str) -> httpx.AsyncClient:
+    """Pooled async client for a provider, created on first use"""
+    client = http_clients.get(provider)
+    if client is None:
+        limits = PROVIDER_LIMITS[provider]
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=limits["max_connections"],
+                max_keepalive_connections=limits["max_connections"]
+            ),
+            timeout=httpx.Timeout(limits["timeout"], connect=PROVIDER_CONNECT_TIMEOUT)
+        )
+        http_clients[provider] = client
+    return client
+
+class ProviderRouter:
+    """Orders providers by EWMA latency and error rate, skipping open circuits"""
+    
+    def __init__(self, alpha: float, failure_threshold: int, open_seconds: float, error_penalty: float,
+                 failure_latencies: Optional[Dict[str, float]] = None):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.error_penalty = error_penalty
+        # Latency a failed call is charged (the provider's timeout), so failing fast never scores as fast
+        self.failure_latencies = failure_latencies or {}
+        self.providers = {}
+    
+    def _state(self, provider: str) -> Dict[str, Any]:
+        if provider not in self.providers:
+            self.providers[provider] = {
+                "latency_ewma": None,
+                "error_ewma": 0.0,
+                "consecutive_failures": 0,
+                "circuit": "closed",
+                "opened_at": None,
+                "probe_in_flight": False,
+                "recent_latencies": deque(maxlen=200),
+                "requests": 0,
+                "failures": 0
+            }
+        return self.providers[provider]
+    
+    def score(self, provider: str) -> float:
+        """Expected cost of a call; untried providers score 0 so they get measured"""
+        state = self._state(provider)
+        if state["latency_ewma"] is None:
+            return 0.0
+        return state["latency_ewma"] * (1 + self.error_penalty * state["error_ewma"])
+    
+    def available(self, provider: str) -> bool:
+        state = self._state(provider)
+        if state["circuit"] == "closed":
+            return True
+        if state["circuit"] == "open" and time.monotonic() - state["opened_at"] >= self.open_seconds:
+            state["circuit"] = "half_open"
+        return state["circuit"] == "half_open" and not state["probe_in_flight"]
+    
+    def order(self, candidates: List[str]) -> List[str]:
+        """Healthy candidates, fastest first (ties keep the preference order)"""
+        return sorted((p for p in candidates if self.available(p)), key=self.score)
+    
+    def begin(self, provider: str):
+        state = self._state(provider)
+        state["requests"] += 1
+        if state["circuit"] == "half_open":
+            state["probe_in_flight"] = True
+    
+    def end(self, provider: str):
+        """Release a half-open probe slot, whatever happened to the call"""
+        self._state(provider)["probe_in_flight"] = False
+    
+    def _observe(self, state: Dict[str, Any], latency: float, failed: bool):
+        if state["latency_ewma"] is None:
+            state["latency_ewma"] = latency
+        else:
+            state["latency_ewma"] += self.alpha * (latency - state["latency_ewma"])
+        state["error_ewma"] += self.alpha * ((1.0 if failed else 0.0) - state["error_ewma"])
+    
+    def latency_percentile(self, provider: str, pct: float, min_samples: int) -> Optional[float]:
+        """Percentile of recent successful call latencies, None until there are enough"""
+        latencies = sorted(self._state(provider)["recent_latencies"])
+        if len(latencies) < min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(pct / 100 * len(latencies)))]
+    
+    def record_success(self, provider: str, latency: float):
+        state = self._state(provider)
+        self._observe(state, latency, failed=False)
+        state["recent_latencies"].append(latency)
+        state["consecutive_failures"] = 0
+        if state["circuit"] != "closed":
+            logger.info(f"Circuit for {provider} closed")
+        state["circuit"] = "closed"
+        state["opened_at"] = None
+    
+    def record_failure(self, provider: str, latency: float):
+        state = self._state(provider)
+        self._observe(state, max(latency, self.failure_latencies.get(provider, latency)), failed=True)
+        state["failures"] += 1
+        state["consecutive_failures"] += 1
+        if state["circuit"] == "half_open" or state["consecutive_failures"] >= self.failure_threshold:
+            if state["circuit"] != "open":
+                logger.warning(f"Circuit for {provider} opened after {state['consecutive_failures']} consecutive failures")
+            state["circuit"] = "open"
+            state["opened_at"] = time.monotonic()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
         return {
-            "success": False,
-            "error": str(e),
-            "full_text": "",
-            "chunks": [],
-            "total_pages": 0,
-            "total_characters": 0
+            provider: {
+                "circuit": state["circuit"],
+                "latency_ewma_ms": round(state["latency_ewma"] * 1000, 1) if state["latency_ewma"] is not None else None,
+                "error_rate_ewma": round(state["error_ewma"], 3),
+                "consecutive_failures": state["consecutive_failures"],
+                "retry_in_seconds": round(max(0.0, self.open_seconds - (now - state["opened_at"])), 1) if state["circuit"] == "open" else None,
+                "score": round(self.score(provider), 4),
+                "requests": state["requests"],
+                "failures": state["failures"]
+            }
+            for provider, state in self.providers.items()
         }
 
+provider_router = ProviderRouter(
+    ROUTER_EWMA_ALPHA, ROUTER_FAILURE_THRESHOLD, ROUTER_OPEN_SECONDS, ROUTER_ERROR_PENALTY,
+    {provider: limits["timeout"] for provider, limits in PROVIDER_LIMITS.items()}
+)
+
+# Hedges sent in the last minute, and hedging outcomes
+hedge_times = deque()
+hedge_stats = {"hedged_requests": 0, "hedge_wins": 0, "budget_exhausted": 0}
+
+def take_hedge_budget() -> bool:
+    """Spend one hedge from the per-minute budget, if any is left"""
+    now = time.monotonic()
+    while hedge_times and now - hedge_times[0] >= 60:
+        hedge_times.popleft()
+    if len(hedge_times) >= HEDGE_BUDGET_PER_MINUTE:
+        hedge_stats["budget_exhausted"] += 1
+        return False
+    hedge_times.append(now)
+    hedge_stats["hedged_requests"] += 1
+    return True
+
+@app.on_event("startup")
+async def prepare_document_store():
+    document_store.clear_spilled()
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    for client in http_clients.values():
+        await client.aclose()
+    http_clients.clear()
+
 async def call_deepseek_api(messages: List[Dict], max_tokens: int = 500, temperature: float = 0.7) -> str:
     """Call DeepSeek API"""
     
@@ -179,11 +540,10 @@ async def call_deepseek_api(messages: List[Dict], max_tokens: int = 500, tempera
             "temperature": temperature
         }
         
-        response = requests.post(
+        response = await get_http_client("deepseek").post(
             f"{DEEPSEEK_BASE_URL}/chat/completions",
             headers=headers,
-            json=data,
-            timeout=30
+            json=data
         )
         
         if response.status_code == 200:
@@ -233,11 +593,10 @@ async def call_huggingface_api(messages: List[Dict], max_tokens: int = 500, temp
             }
         }
         
-        response = requests.post(
+        response = await get_http_client("huggingface").post(
             HUGGINGFACE_API_URL,
             headers=headers,
-            json=payload,
-            timeout=30
+            json=payload
         )
         
         if response.status_code == 200:
@@ -264,10 +623,9 @@ async def call_vllm_api(messages: List[Dict], max_tokens: int = 500, temperature
             "temperature": temperature
         }
         
-        response = requests.post(
+        response = await get_http_client("vllm").post(
             f"{VLLM_BASE_URL}/v1/chat/completions",
-            json=data,
-            timeout=30
+            json=data
         )
         
         if response.status_code == 200:
@@ -280,61 +638,263 @@ async def call_vllm_api(messages: List[Dict], max_tokens: int = 500, temperature
         logger.error(f"vLLM API call failed: {e}")
         raise
 
+# Workers run pdf_extraction.extract_pdf_text; spawn also re-runs this script's
+# top level in each of them, which only defines things (startup work is in hooks)
+extraction_executor = ProcessPoolExecutor(
+    max_workers=PDF_EXTRACT_WORKERS,
+    mp_context=multiprocessing.get_context("spawn")
+)
+
+async def run_pdf_extraction(file_path: str) -> Dict[str, Any]:
+    """Run extract_pdf_text in the extraction pool, giving up after PDF_EXTRACT_TIMEOUT
+
+    A timed-out extraction keeps its worker busy until it finishes; the request
+    fails with 504 straight away.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(extraction_executor, extract_pdf_text, file_path),
+            timeout=PDF_EXTRACT_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        logger.error(f"PDF extraction timed out after {PDF_EXTRACT_TIMEOUT}s: {file_path}")
+        raise HTTPException(status_code=504, detail=f"PDF extraction timed out after {PDF_EXTRACT_TIMEOUT:g}s")
+
+@app.on_event("shutdown")
+async def stop_extraction_workers():
+    extraction_executor.shutdown(wait=False, cancel_futures=True)
+
+async def stream_openai_compatible(provider: str, url: str, headers: Dict[str, str], data: Dict[str, Any]) -> AsyncIterator[str]:
+    """Yield content deltas from an OpenAI-style SSE chat completion stream"""
+    async with get_http_client(provider).stream("POST", url, headers=headers, json={**data, "stream": True}) as response:
+        if response.status_code != 200:
+            await response.aread()
+            raise Exception(f"{provider} API error: {response.status_code} - {response.text}")
+        
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            payload = line[5:].strip()
+            if payload == "[DONE]":
+                break
+            choices = json.loads(payload).get("choices") or [{}]
+            delta = choices[0].get("delta", {}).get("content")
+            if delta:
+                yield delta
+
+def stream_deepseek_api(messages: List[Dict], max_tokens: int = 500, temperature: float = 0.7) -> AsyncIterator[str]:
+    """Stream a DeepSeek chat completion"""
+    if not DEEPSEEK_API_KEY or DEEPSEEK_API_KEY == 'your_deepseek_api_key_here':
+        raise Exception("DeepSeek API key not configured")
+    
+    return stream_openai_compatible(
+        "deepseek",
+        f"{DEEPSEEK_BASE_URL}/chat/completions",
+        {"Authorization": f"Bearer {DEEPSEEK_API_KEY}", "Content-Type": "application/json"},
+        {"model": "deepseek-chat", "messages": messages, "max_tokens": max_tokens, "temperature": temperature}
+    )
+
+def stream_vllm_api(messages: List[Dict], max_tokens: int = 500, temperature: float = 0.7) -> AsyncIterator[str]:
+    """Stream a vLLM chat completion"""
+    return stream_openai_compatible(
+        "vllm",
+        f"{VLLM_BASE_URL}/v1/chat/completions",
+        {"Content-Type": "application/json"},
+        {
+            "model": os.getenv("VLLM_MODEL", "mistralai/Mistral-7B-Instruct-v0.2"),
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+    )
+
+# Providers with native token streaming; others are sent as a single chunk
+STREAMING_PROVIDERS = {
+    "deepseek": (stream_deepseek_api, "deepseek-chat"),
+    "vllm": (stream_vllm_api, "vllm-local")
+}
+
+async def call_provider(model_name: str, messages: List[Dict], max_tokens: int, temperature: float) -> Dict[str, Any]:
+    """Call one provider, recording the outcome with the router"""
+    provider_router.begin(model_name)
+    started = time.monotonic()
+    try:
+        if model_name == "deepseek":
+            response = await call_deepseek_api(messages, max_tokens, temperature)
+            result = {"content": response, "model": "deepseek-chat", "success": True}
+        
+        elif model_name == "huggingface":
+            response = await call_huggingface_api(messages, max_tokens, temperature)
+            result = {"content": response, "model": "ibm-granite", "success": True}
+        
+        elif model_name == "vllm":
+            response = await call_vllm_api(messages, max_tokens, temperature)
+            result = {"content": response, "model": "vllm-local", "success": True}
+        
+        provider_router.record_success(model_name, time.monotonic() - started)
+        return result
+    
+    except Exception as e:
+        provider_router.record_failure(model_name, time.monotonic() - started)
+        logger.warning(f"Model {model_name} failed: {e}")
+        raise
+    finally:
+        provider_router.end(model_name)
+
+async def hedged_response(models_to_try: List[str], messages: List[Dict], max_tokens: int,
+                          temperature: float, errors: List[str]) -> Optional[Dict[str, Any]]:
+    """Try providers in order, hedging once if the first one is slow
+
+    The first provider gets until its HEDGE_PERCENTILE latency; after that the
+    next provider is started too (budget permitting) and whichever answers
+    first wins, the other call is cancelled. Failures fall through to the next
+    provider as usual. Returns None if every provider failed.
+    """
+    queue = list(models_to_try)
+    pending = {}
+    hedged = False
+    
+    def launch():
+        name = queue.pop(0)
+        task = asyncio.create_task(call_provider(name, messages, max_tokens, temperature))
+        pending[task] = name
+    
+    launch()
+    primary = models_to_try[0]
+    deadline = provider_router.latency_percentile(primary, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES) or HEDGE_DEFAULT_DELAY
+    
+    try:
+        while pending:
+            timeout = deadline if queue and not hedged else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            
+            if not done:
+                # Primary is past its deadline: hedge with the next provider
+                hedged = True
+                if take_hedge_budget():
+                    logger.info(f"Hedging {primary} after {deadline:.2f}s with {queue[0]}")
+                    launch()
+                continue
+            
+            for task in done:
+                name = pending.pop(task)
+                if task.exception() is None:
+                    if hedged and name != primary:
+                        hedge_stats["hedge_wins"] += 1
+                    return task.result()
+                errors.append(f"{name}: {str(task.exception())}")
+            
+            # Nothing left in flight: fall through to the next provider
+            if not pending and queue:
+                launch()
+        
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+
 async def get_ai_response(messages: List[Dict], model: str = "auto", max_tokens: int = 500, temperature: float = 0.7) -> Dict[str, Any]:
     """Get AI response from specified model or auto-select best available"""
     
     errors = []
     
-    # Auto-select model or try specified model
-    models_to_try = []
+    # Auto-select model or try specified model: configured providers are
+    # re-ordered by the router, fastest healthy provider first
+    models_to_try = candidate_models(model, errors)
     
-    if model == "auto":
-        # Try in order of preference
-        if DEEPSEEK_API_KEY and DEEPSEEK_API_KEY != 'your_deepseek_api_key_here':
-            models_to_try.append("deepseek")
-        if HUGGINGFACE_API_KEY:
-            models_to_try.append("huggingface")
-        models_to_try.append("vllm")
+    if HEDGE_ENABLED and len(models_to_try) > 1:
+        result = await hedged_response(models_to_try, messages, max_tokens, temperature, errors)
+        if result:
+            return result
     else:
-        models_to_try = [model]
-    
-    for model_name in models_to_try:
-        try:
-            if model_name == "deepseek":
-                response = await call_deepseek_api(messages, max_tokens, temperature)
-                return {"content": response, "model": "deepseek-chat", "success": True}
-            
-            elif model_name == "huggingface":
-                response = await call_huggingface_api(messages, max_tokens, temperature)
-                return {"content": response, "model": "ibm-granite", "success": True}
-            
-            elif model_name == "vllm":
-                response = await call_vllm_api(messages, max_tokens, temperature)
-                return {"content": response, "model": "vllm-local", "success": True}
-                
-        except Exception as e:
-            error_msg = f"{model_name}: {str(e)}"
-            errors.append(error_msg)
-            logger.warning(f"Model {model_name} failed: {e}")
-            continue
+        for model_name in models_to_try:
+            try:
+                return await call_provider(model_name, messages, max_tokens, temperature)
+            except Exception as e:
+                errors.append(f"{model_name}: {str(e)}")
+                continue
     
     # All models failed, return fallback
+    return {
+        "content": fallback_text(messages),
+        "model": "fallback",
+        "success": False,
+        "errors": errors
+    }
+
+def fallback_text(messages: List[Dict]) -> str:
+    """Canned reply used when every model failed"""
     user_message = messages[-1].get('content', '') if messages else ''
     user_lower = user_message.lower()
     
     if any(word in user_lower for word in ['hello', 'hi', 'hey']):
-        fallback_response = "Hello! I'm StudyMate, your AI learning assistant. I can help you with questions, analyze documents, and support your studies. How can I assist you today?"
+        return "Hello! I'm StudyMate, your AI learning assistant. I can help you with questions, analyze documents, and support your studies. How can I assist you today?"
     elif any(word in user_lower for word in ['who', 'what are you']):
-        fallback_response = "I'm StudyMate, an AI-powered learning assistant that can use multiple AI models including DeepSeek, IBM Granite, and local models. I can help you with questions, analyze documents, and support your studies."
+        return "I'm StudyMate, an AI-powered learning assistant that can use multiple AI models including DeepSeek, IBM Granite, and local models. I can help you with questions, analyze documents, and support your studies."
     else:
-        fallback_response = f"I understand you're asking about '{user_message}'. I'm having trouble connecting to my AI models right now, but I'm here to help. Could you try rephrasing your question?"
+        return f"I understand you're asking about '{user_message}'. I'm having trouble connecting to my AI models right now, but I'm here to help. Could you try rephrasing your question?"
+
+def candidate_models(model: str, errors: List[str]) -> List[str]:
+    """Providers to try for a request, in routed order"""
+    if model != "auto":
+        if model not in PROVIDER_LIMITS:
+            errors.append(f"{model}: unknown model")
+            return []
+        return [model]
     
-    return {
-        "content": fallback_response,
-        "model": "fallback",
-        "success": False,
-        "errors": errors
-    }
+    configured = []
+    if DEEPSEEK_API_KEY and DEEPSEEK_API_KEY != 'your_deepseek_api_key_here':
+        configured.append("deepseek")
+    if HUGGINGFACE_API_KEY:
+        configured.append("huggingface")
+    configured.append("vllm")
+    
+    routed = provider_router.order(configured)
+    for skipped in configured:
+        if skipped not in routed:
+            errors.append(f"{skipped}: circuit open")
+    return routed
+
+async def stream_ai_response(messages: List[Dict], model: str = "auto", max_tokens: int = 500,
+                             temperature: float = 0.7) -> AsyncIterator[Tuple[str, str]]:
+    """Yield (model, delta) pairs, falling through providers until one starts streaming
+
+    Once a provider has produced its first token it is committed to; a later
+    failure ends the stream early instead of restarting on another provider.
+    """
+    errors = []
+    for model_name in candidate_models(model, errors):
+        provider_router.begin(model_name)
+        started = time.monotonic()
+        first_token = None
+        try:
+            if model_name in STREAMING_PROVIDERS:
+                stream_func, label = STREAMING_PROVIDERS[model_name]
+                async for delta in stream_func(messages, max_tokens, temperature):
+                    if first_token is None:
+                        first_token = time.monotonic() - started
+                    yield label, delta
+            else:
+                content = await call_huggingface_api(messages, max_tokens, temperature)
+                first_token = time.monotonic() - started
+                yield "ibm-granite", content
+            
+            total = time.monotonic() - started
+            provider_router.record_success(model_name, total)
+            logger.info(f"Streamed {model_name}: first token {first_token if first_token is not None else total:.3f}s, total {total:.3f}s")
+            return
+        except Exception as e:
+            provider_router.record_failure(model_name, time.monotonic() - started)
+            logger.warning(f"Model {model_name} stream failed: {e}")
+            if first_token is not None:
+                return
+            errors.append(f"{model_name}: {str(e)}")
+        finally:
+            provider_router.end(model_name)
+    
+    logger.warning(f"All models failed to stream, sending fallback: {errors}")
+    yield "fallback", fallback_text(messages)
 
 @app.get("/")
 async def root():
@@ -395,7 +955,50 @@ async def list_models():
         "parent": None
     })
     
-    return {"object": "list", "data": models}
+    return {
+        "object": "list",
+        "data": models,
+        "router": provider_router.snapshot(),
+        "hedging": {
+            "enabled": HEDGE_ENABLED,
+            "percentile": HEDGE_PERCENTILE,
+            "budget_per_minute": HEDGE_BUDGET_PER_MINUTE,
+            "hedges_last_minute": sum(1 for sent in hedge_times if time.monotonic() - sent < 60),
+            **hedge_stats
+        }
+    }
+
+async def sse_chat_stream(messages: List[Dict], model: str, max_tokens: int, temperature: float) -> AsyncIterator[str]:
+    """Format streamed deltas as OpenAI chat.completion.chunk server-sent events"""
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:8]}"
+    created = int(time.time())
+    started = time.monotonic()
+    model_label = None
+    completion = []
+    
+    def event(delta: Dict[str, Any], finish_reason: Optional[str] = None, usage: Optional[Dict[str, Any]] = None) -> str:
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model_label,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        if usage:
+            chunk["usage"] = usage
+        return f"data: {json.dumps(chunk)}\n\n"
+    
+    async for label, delta in stream_ai_response(messages, model, max_tokens, temperature):
+        if model_label is None:
+            model_label = label
+            logger.info(f"Time to first token ({label}): {time.monotonic() - started:.3f}s")
+            yield event({"role": "assistant", "content": ""})
+        completion.append(delta)
+        yield event({"content": delta})
+    
+    usage = await asyncio.to_thread(token_counter.usage_for, model_label, messages, "".join(completion))
+    yield event({}, "stop", usage)
+    yield "data: [DONE]\n\n"
 
 @app.post("/v1/chat/completions")
 async def chat_completions(request: Request):
@@ -413,6 +1016,13 @@ async def chat_completions(request: Request):
         if not messages:
             raise HTTPException(status_code=400, detail="Messages are required")
         
+        if stream:
+            return StreamingResponse(
+                sse_chat_stream(messages, model, max_tokens, temperature),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+        
         # Get AI response
         result = await get_ai_response(messages, model, max_tokens, temperature)
         
@@ -430,11 +1040,7 @@ async def chat_completions(request: Request):
                 },
                 "finish_reason": "stop"
             }],
-            "usage": {
-                "prompt_tokens": len(str(messages)),
-                "completion_tokens": len(result["content"]),
-                "total_tokens": len(str(messages)) + len(result["content"])
-            }
+            "usage": await asyncio.to_thread(token_counter.usage_for, result["model"], messages, result["content"])
         }
         
         if not result["success"]:
@@ -462,22 +1068,23 @@ async def upload_pdf(file: UploadFile = File(...)):
     
     try:
         # Extract text from PDF
-        extraction_result = extract_pdf_text(tmp_file_path)
+        extraction_result = await run_pdf_extraction(tmp_file_path)
         
         if not extraction_result["success"]:
             raise HTTPException(status_code=500, detail=f"PDF extraction failed: {extraction_result['error']}")
         
         # Store document
         doc_id = str(uuid.uuid4())
-        document_store[doc_id] = {
+        await document_store.put(doc_id, {
             "id": doc_id,
             "filename": file.filename,
             "upload_time": datetime.now().isoformat(),
             "full_text": extraction_result["full_text"],
             "chunks": extraction_result["chunks"],
+            "page_offsets": extraction_result["page_offsets"],
             "total_pages": extraction_result["total_pages"],
             "total_characters": extraction_result["total_characters"]
-        }
+        })
         
         return {
             "success": True,
@@ -503,6 +1110,254 @@ async def upload_pdf(file: UploadFile = File(...)):
         except:
             pass
 
+class SummaryCache:
+    """Two-tier summary cache keyed by (PDF content hash, model, prompt version)"""
+    
+    def __init__(self, max_entries: int, directory: str, max_disk_entries: int, max_disk_bytes: int):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_entries = 0
+        self.disk_bytes = 0
+        self.disk_evictions = 0
+    
+    def prepare(self):
+        """Create the disk tier, dropping temp files of interrupted writes and files over the limits"""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                os.unlink(os.path.join(self.directory, name))
+        self._prune()
+    
+    @staticmethod
+    def key(content: bytes, model: str) -> str:
+        content_hash = hashlib.sha256(content).hexdigest()
+        return hashlib.sha256(f"{content_hash}:{model}:{SUMMARY_PROMPT_VERSION}".encode()).hexdigest()
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+    
+    def _remember(self, key: str, entry: Dict[str, Any]):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+            # The mtime doubles as the last use, so pruning drops the least recently used files
+            os.utime(self._path(key))
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Unreadable summary cache entry {key}: {e}")
+            return None
+    
+    def _write(self, key: str, entry: Dict[str, Any]):
+        # Write then rename so readers never see a partial file; concurrent
+        # writers of one key each get their own temp file
+        tmp_path = f"{self._path(key)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self._path(key))
+        self._prune()
+    
+    def _prune(self):
+        """Delete the least recently used files beyond the disk entry and size limits"""
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                info = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            files.append((info.st_mtime, info.st_size, name))
+        
+        # Keep the newest files that fit; everything older than the first misfit goes
+        files.sort(reverse=True)
+        kept, kept_bytes = 0, 0
+        for _, size, _ in files:
+            if kept >= self.max_disk_entries or kept_bytes + size > self.max_disk_bytes:
+                break
+            kept += 1
+            kept_bytes += size
+        for _, _, name in files[kept:]:
+            try:
+                os.unlink(os.path.join(self.directory, name))
+                self.disk_evictions += 1
+            except FileNotFoundError:
+                pass
+        self.disk_entries, self.disk_bytes = kept, kept_bytes
+    
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.memory_hits += 1
+            return entry
+        
+        if self.directory:
+            entry = await asyncio.to_thread(self._read, key)
+            if entry is not None:
+                self._remember(key, entry)
+                self.disk_hits += 1
+                return entry
+        
+        self.misses += 1
+        return None
+    
+    async def put(self, key: str, entry: Dict[str, Any]):
+        self._remember(key, entry)
+        if self.directory:
+            try:
+                await asyncio.to_thread(self._write, key, entry)
+            except Exception as e:
+                logger.warning(f"Could not write summary cache entry {key}: {e}")
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self.entries),
+            "max_memory_entries": self.max_entries,
+            "disk_enabled": bool(self.directory),
+            "disk_entries": self.disk_entries,
+            "disk_bytes": self.disk_bytes,
+            "max_disk_entries": self.max_disk_entries,
+            "max_disk_bytes": self.max_disk_bytes,
+            "disk_evictions": self.disk_evictions,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "prompt_version": SUMMARY_PROMPT_VERSION
+        }
+
+summary_cache = SummaryCache(SUMMARY_CACHE_SIZE, SUMMARY_CACHE_DIR, SUMMARY_CACHE_DISK_ENTRIES, SUMMARY_CACHE_DISK_MB * 1024 * 1024)
+token_counter = TokenCounter(TOKENIZER_NAMES, TOKEN_COUNT_CACHE_SIZE)
+
+@app.on_event("startup")
+async def prepare_summary_cache():
+    summary_cache.prepare()
+
+def group_chunks(chunks: List[Dict[str, Any]], max_chars: int) -> List[str]:
+    """Join consecutive chunks into sections of at most max_chars, labelled with their pages"""
+    sections = []
+    current = []
+    length = 0
+    
+    def flush():
+        first, last = current[0]["page"], current[-1]["page"]
+        pages = f"Page {first}" if first == last else f"Pages {first}-{last}"
+        sections.append(f"[{pages}]\n" + "\n".join(chunk["content"] for chunk in current))
+    
+    for chunk in chunks:
+        if current and length + len(chunk["content"]) > max_chars:
+            flush()
+            current, length = [], 0
+        current.append(chunk)
+        length += len(chunk["content"])
+    if current:
+        flush()
+    return sections
+
+async def map_reduce_summary(chunks: List[Dict[str, Any]], model: str = "auto") -> Dict[str, Any]:
+    """Summarise a whole document: sections in parallel, then combine the partial summaries
+
+    Sections are summarised concurrently (up to SUMMARY_CONCURRENCY calls), then
+    groups of SUMMARY_REDUCE_FANIN summaries are merged level by level until one
+    is left, so wall-clock time grows with the number of levels, log(sections).
+    
+    A call that still fails after SUMMARY_RETRIES retries doesn't fail the
+    document: a map call falls back to an excerpt of its section, a reduce
+    call to its input summaries, and the gap is counted in failed_calls.
+    """
+    semaphore = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+    stats = {"model_calls": 0, "failed_calls": 0, "models": set()}
+    
+    async def summarize(prompt: str, max_tokens: int, fallback: str) -> str:
+        messages = [
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+        for attempt in range(SUMMARY_RETRIES + 1):
+            async with semaphore:
+                result = await get_ai_response(messages, model, max_tokens=max_tokens, temperature=0.3)
+            stats["model_calls"] += 1
+            if result["success"]:
+                stats["models"].add(result["model"])
+                return result["content"]
+            logger.warning(f"Summary model call failed (attempt {attempt + 1}): {'; '.join(result.get('errors', []))}")
+        stats["failed_calls"] += 1
+        return fallback
+    
+    def excerpt(section: str) -> str:
+        label, _, text = section.partition("\n")
+        clipped = text[:SUMMARY_EXCERPT_CHARS] + ("..." if len(text) > SUMMARY_EXCERPT_CHARS else "")
+        return f"{label} (could not be summarised, opening excerpt)\n{clipped}"
+    
+    sections = group_chunks(chunks, SUMMARY_GROUP_CHARS)
+    
+    if len(sections) == 1:
+        summary = await summarize(
+            f"Please provide a comprehensive summary of the following document:\n\n{sections[0]}", 1000,
+            excerpt(sections[0])
+        )
+        levels = 0
+    else:
+        # Map: one partial summary per section, in document order
+        summaries = await asyncio.gather(*[
+            summarize(
+                f"Summarize this section of a longer document. Keep the key points, definitions and "
+                f"important details, and mention the pages they come from:\n\n{section}",
+                SUMMARY_PARTIAL_TOKENS,
+                excerpt(section)
+            )
+            for section in sections
+        ])
+        levels = 1
+        
+        # Reduce: merge neighbouring summaries until one comprehensive summary is left
+        while len(summaries) > 1:
+            groups = [summaries[i:i + SUMMARY_REDUCE_FANIN] for i in range(0, len(summaries), SUMMARY_REDUCE_FANIN)]
+            final = len(groups) == 1
+            summaries = await asyncio.gather(*[
+                summarize(
+                    ("Combine these partial summaries of consecutive parts of one document into a single "
+                     "comprehensive summary of the whole document:" if final else
+                     "Combine these partial summaries of consecutive parts of a document into one summary, "
+                     "keeping the key points and page references:")
+                    + "\n\n" + "\n\n".join(group),
+                    1000 if final else SUMMARY_PARTIAL_TOKENS,
+                    "\n\n".join(group)
+                )
+                for group in groups
+            ])
+            levels += 1
+        summary = summaries[0]
+    
+    if not stats["models"]:
+        raise Exception("Every summary model call failed")
+    
+    return {
+        "summary": summary,
+        "model": ", ".join(sorted(stats["models"])),
+        "sections": len(sections),
+        "levels": levels,
+        "model_calls": stats["model_calls"],
+        "failed_calls": stats["failed_calls"]
+    }
+
 @app.post("/summarize-pdf")
 async def summarize_pdf(file: UploadFile = File(...), model: str = "auto"):
     """Upload PDF and get AI summary"""
@@ -510,15 +1365,22 @@ async def summarize_pdf(file: UploadFile = File(...), model: str = "auto"):
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
     
+    content = await file.read()
+    
+    # Same file, model and prompts as an earlier request: no extraction or model calls
+    cache_key = summary_cache.key(content, model)
+    cached = await summary_cache.get(cache_key)
+    if cached is not None:
+        return {"success": True, "filename": file.filename, **cached, "cached": True}
+    
     # Save uploaded file temporarily
     with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-        content = await file.read()
         tmp_file.write(content)
         tmp_file_path = tmp_file.name
     
     try:
         # Extract text from PDF
-        extraction_result = extract_pdf_text(tmp_file_path)
+        extraction_result = await run_pdf_extraction(tmp_file_path)
         
         if not extraction_result["success"]:
             raise HTTPException(status_code=500, detail=f"PDF extraction failed: {extraction_result['error']}")
@@ -528,32 +1390,32 @@ async def summarize_pdf(file: UploadFile = File(...), model: str = "auto"):
         if len(full_text.strip()) < 50:
             raise HTTPException(status_code=400, detail="PDF contains insufficient text for summarization")
         
-        # Prepare messages for AI
-        messages = [
-            {
-                "role": "system",
-                "content": "You are StudyMate, a helpful AI learning assistant. Provide comprehensive summaries of documents, focusing on key points, main ideas, and important details."
-            },
-            {
-                "role": "user",
-                "content": f"Please provide a comprehensive summary of the following document:\n\n{full_text[:8000]}"  # Limit text to avoid token limits
-            }
-        ]
-        
-        # Get AI summary
-        result = await get_ai_response(messages, model, max_tokens=1000, temperature=0.3)
+        # Get AI summary of the whole document
+        started = time.monotonic()
+        result = await map_reduce_summary(extraction_result["chunks"], model)
+        logger.info(
+            f"Summarized {file.filename}: {result['sections']} sections, {result['levels']} levels, "
+            f"{result['model_calls']} model calls in {time.monotonic() - started:.2f}s"
+        )
         
-        return {
-            "success": True,
-            "filename": file.filename,
-            "summary": result["content"],
+        summary = {
+            "summary": result["summary"],
             "model_used": result["model"],
             "document_stats": {
                 "total_pages": extraction_result["total_pages"],
                 "total_characters": extraction_result["total_characters"],
-                "chunks_processed": len(extraction_result["chunks"])
+                "chunks_processed": len(extraction_result["chunks"]),
+                "sections": result["sections"],
+                "reduce_levels": result["levels"],
+                "model_calls": result["model_calls"],
+                "failed_calls": result["failed_calls"]
             }
         }
+        # A summary with gaps isn't cached, so a later request can fill them
+        if not result["failed_calls"]:
+            await summary_cache.put(cache_key, summary)
+        
+        return {"success": True, "filename": file.filename, **summary, "cached": False}
         
     except HTTPException:
         raise
@@ -568,29 +1430,81 @@ async def summarize_pdf(file: UploadFile = File(...), model: str = "auto"):
         except:
             pass
 
+@app.get("/metrics")
+async def metrics():
+    """Server metrics"""
+    return {
+        "summary_cache": summary_cache.stats(),
+        "document_store": document_store.stats(),
+        "tokens": token_counter.stats()
+    }
+
 @app.get("/documents")
 async def list_documents():
     """List uploaded documents"""
     return {
         "documents": [
-            {
-                "id": doc_id,
-                "filename": doc["filename"],
-                "upload_time": doc["upload_time"],
-                "total_pages": doc["total_pages"],
-                "total_characters": doc["total_characters"]
-            }
-            for doc_id, doc in document_store.items()
+            {field: doc[field] for field in ("id", "filename", "upload_time", "total_pages", "total_characters")}
+            for doc in document_store.list_metadata()
         ]
     }
 
 @app.get("/documents/{doc_id}")
-async def get_document(doc_id: str):
-    """Get specific document details"""
+async def get_document(doc_id: str, full: bool = False):
+    """Get document metadata (full=true returns the whole record, text and all chunks)"""
+    if doc_id not in document_store:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    if full:
+        return await document_store.get(doc_id)
+    return document_store.metadata[doc_id]
+
+@app.get("/documents/{doc_id}/chunks")
+async def get_document_chunks(doc_id: str, offset: int = 0, limit: int = 50):
+    """Page through a document's chunks; next_offset is None after the last page"""
+    if doc_id not in document_store:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if offset < 0 or limit < 1:
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit >= 1")
+    
+    limit = min(limit, DOCUMENT_CHUNKS_MAX_LIMIT)
+    total = document_store.metadata[doc_id]["chunk_count"]
+    next_offset = offset + limit
+    
+    return {
+        "document_id": doc_id,
+        "offset": offset,
+        "limit": limit,
+        "total": total,
+        "chunks": await document_store.read_chunks(doc_id, offset, next_offset),
+        "next_offset": next_offset if next_offset < total else None
+    }
+
+@app.get("/documents/{doc_id}/text")
+async def get_document_text(doc_id: str, start_page: int = 1, end_page: Optional[int] = None):
+    """Text of a page range (1-based, inclusive), at most DOCUMENT_TEXT_MAX_PAGES pages"""
     if doc_id not in document_store:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    return document_store[doc_id]
+    total_pages = document_store.metadata[doc_id]["total_pages"]
+    end_page = end_page or start_page
+    if start_page < 1 or end_page < start_page or end_page > total_pages:
+        raise HTTPException(status_code=416, detail=f"Page range {start_page}-{end_page} outside 1-{total_pages}")
+    if end_page - start_page + 1 > DOCUMENT_TEXT_MAX_PAGES:
+        raise HTTPException(status_code=400, detail=f"At most {DOCUMENT_TEXT_MAX_PAGES} pages per request")
+    
+    texts = await document_store.read_pages(doc_id, start_page - 1, end_page)
+    
+    return {
+        "document_id": doc_id,
+        "start_page": start_page,
+        "end_page": end_page,
+        "total_pages": total_pages,
+        "pages": [
+            {"page_number": page_number, "text": text}
+            for page_number, text in enumerate(texts, start_page)
+        ]
+    }
 
 if __name__ == "__main__":
     import uvicorn
@@ -615,7 +1529,8 @@ if __name__ == "__main__":
     print(f"  DeepSeek: {'✅' if DEEPSEEK_API_KEY and DEEPSEEK_API_KEY != 'your_deepseek_api_key_here' else '❌'}")
     print(f"  Hugging Face: {'✅' if HUGGINGFACE_API_KEY else '❌'}")
     print(f"  vLLM: ✅ (will try {VLLM_BASE_URL})")
-    print(f"  PDF Processing: {'✅' if PDF_AVAILABLE else '❌'}")
+    print(f"  Hugging Face transformers: {'✅' if HF_AVAILABLE else '❌'}")
+    print(f"  PDF Processing: {'✅ ' + PDF_LIBRARY if PDF_AVAILABLE else '❌'}")
     print()
     print("=" * 60)
     
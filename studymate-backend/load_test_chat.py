@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Chat load test for the StudyMate All-Models Server
+Fires concurrent /v1/chat/completions requests at increasing concurrency and
+reports throughput and latency, so blocking provider calls show up as flat
+throughput instead of scaling with connections.
+
+    python load_test_chat.py mock --latency 0.5          # fake vLLM on :8000
+    python load_test_chat.py run --concurrency 1,4,16,64 --requests 128
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+from typing import List, Dict, Any
+
+import httpx
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+async def run_level(url: str, model: str, concurrency: int, total: int) -> Dict[str, Any]:
+    """Send total requests with at most concurrency in flight"""
+    latencies = []
+    failures = 0
+    remaining = iter(range(total))
+    payload = {
+        "model": model,
+        "messages": [{"role": "user", "content": "Explain photosynthesis in one sentence."}],
+        "max_tokens": 64
+    }
+
+    async with httpx.AsyncClient(
+        timeout=120,
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    ) as client:
+        async def worker():
+            nonlocal failures
+            for _ in remaining:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(f"{url}/v1/chat/completions", json=payload)
+                    ok = response.status_code == 200 and response.json().get("model") != "fallback"
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                if not ok:
+                    failures += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "failures": failures,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(total / elapsed, 2),
+        "p50": round(percentile(latencies, 50), 3),
+        "p95": round(percentile(latencies, 95), 3)
+    }
+
+async def run(url: str, model: str, levels: List[int], total: int):
+    print("🚀 StudyMate Chat Load Test")
+    print("=" * 60)
+    print(f"  Target: {url}  Model: {model}  Requests per level: {total}")
+    print()
+    print(f"  {'conc':>5} {'req/s':>9} {'p50 s':>8} {'p95 s':>8} {'failed':>7}")
+
+    baseline = None
+    for concurrency in levels:
+        result = await run_level(url, model, concurrency, total)
+        baseline = baseline or result["requests_per_second"]
+        print(f"  {result['concurrency']:>5} {result['requests_per_second']:>9} {result['p50']:>8} "
+              f"{result['p95']:>8} {result['failures']:>7}   x{result['requests_per_second'] / baseline:.1f}")
+
+def serve_mock(port: int, latency: float):
+    """Minimal OpenAI-compatible upstream that answers after a fixed delay"""
+    from fastapi import FastAPI
+    import uvicorn
+
+    mock = FastAPI()
+
+    @mock.post("/v1/chat/completions")
+    async def completions(body: Dict[str, Any]):
+        await asyncio.sleep(latency)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:8]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "Plants turn light, water and CO2 into sugar and oxygen."},
+                "finish_reason": "stop"
+            }]
+        }
+
+    print(f"🧪 Mock provider on :{port} ({latency}s per completion)")
+    uvicorn.run(mock, host="0.0.0.0", port=port, log_level="warning")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test StudyMate chat completions")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the load test")
+    run_parser.add_argument("--url", default="http://localhost:8002")
+    run_parser.add_argument("--model", default="vllm")
+    run_parser.add_argument("--concurrency", default="1,4,16,64", help="Comma separated concurrency levels")
+    run_parser.add_argument("--requests", type=int, default=128, help="Requests per concurrency level")
+
+    mock_parser = subparsers.add_parser("mock", help="Serve a fake vLLM endpoint with fixed latency")
+    mock_parser.add_argument("--port", type=int, default=8000)
+    mock_parser.add_argument("--latency", type=float, default=0.5)
+
+    args = parser.parse_args()
+    if args.command == "mock":
+        serve_mock(args.port, args.latency)
+    else:
+        levels = [int(level) for level in args.concurrency.split(",")]
+        asyncio.run(run(args.url, args.model, levels, args.requests))
+
+if __name__ == "__main__":
+    main()
@@ -76,6 +76,19 @@ documentChunkSchema.pre('save', function(next) {
   next();
 });
 
+// Bump the shared chunk generation so the embedding service rebuilds its cached search index
+const bumpChunkGeneration = async function() {
+  await mongoose.connection.collection('chunkgenerations').updateOne(
+    { _id: 'documentchunks' },
+    { $inc: { generation: 1 } },
+    { upsert: true }
+  );
+};
+
+documentChunkSchema.post('deleteMany', bumpChunkGeneration);
+documentChunkSchema.post('deleteOne', bumpChunkGeneration);
+documentChunkSchema.post('insertMany', bumpChunkGeneration);
+
 // Static method to get document chunks with pagination
 documentChunkSchema.statics.getDocumentChunks = function(documentId, page = 1, limit = 20) {
   const skip = (page - 1) * limit;
@@ -1,13 +1,29 @@
 #!/usr/bin/env python3
 """
 PDF Processing Debug Tool for StudyMate
-Tests and diagnoses PyMuPDF PDF extraction issues
+Tests and diagnoses PyMuPDF PDF extraction issues, and profiles extraction
+over a whole directory of PDFs:
+
+    python pdf_debug.py                          # diagnostics
+    python pdf_debug.py profile ../uploads --workers 4 --json report.json --csv pages.csv
 """
 
 import os
 import sys
+import csv
+import json
+import time
+import argparse
 import logging
+import multiprocessing
 from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
 
 # Setup logging
 logging.basicConfig(
@@ -190,5 +206,194 @@ def diagnose_pdf_issues():
     print("🎯 Diagnosis Complete!")
     print("Check pdf_debug.log for detailed logs")
 
+def peak_memory_mb() -> Optional[float]:
+    """Peak resident memory of this process in MB (None where unsupported)"""
+    if not RESOURCE_AVAILABLE:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(peak / divisor, 1)
+
+def profile_pdf(pdf_path: str) -> Dict[str, Any]:
+    """Extract every page of one PDF the way the PDF processor does, timing each page
+
+    Runs in a pool worker that handles a single document, so the peak
+    memory reported belongs to this document alone.
+    """
+    import fitz  # PyMuPDF
+    
+    result = {
+        "file": pdf_path,
+        "size_bytes": os.path.getsize(pdf_path),
+        "pages": 0,
+        "characters": 0,
+        "empty_pages": 0,
+        "open_seconds": 0.0,
+        "extract_seconds": 0.0,
+        "peak_memory_mb": None,
+        "error": None,
+        "page_stats": []
+    }
+    
+    try:
+        started = time.perf_counter()
+        doc = fitz.open(pdf_path)
+        result["open_seconds"] = time.perf_counter() - started
+        
+        for page_num in range(len(doc)):
+            page_started = time.perf_counter()
+            page = doc.load_page(page_num)
+            text = page.get_text()
+            seconds = time.perf_counter() - page_started
+            
+            char_count = len(text.strip())
+            result["pages"] += 1
+            result["characters"] += char_count
+            result["extract_seconds"] += seconds
+            if char_count == 0:
+                result["empty_pages"] += 1
+            
+            result["page_stats"].append({
+                "file": pdf_path,
+                "page": page_num + 1,
+                "seconds": round(seconds, 6),
+                "characters": char_count,
+                "chars_per_second": round(char_count / seconds, 1) if seconds > 0 else 0.0,
+                "empty": char_count == 0,
+                "images": len(page.get_images())
+            })
+        
+        doc.close()
+    except Exception as e:
+        result["error"] = str(e)
+    
+    result["peak_memory_mb"] = peak_memory_mb()
+    return result
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def profile_corpus(directory: str, workers: int = None, top: int = 10) -> Dict[str, Any]:
+    """Profile extraction for every PDF under a directory, in parallel"""
+    pdf_files = sorted(str(path) for path in Path(directory).rglob("*.pdf"))
+    workers = workers or os.cpu_count() or 1
+    
+    print(f"🔍 Profiling {len(pdf_files)} PDFs in {directory} with {workers} workers...")
+    
+    documents = []
+    started = time.perf_counter()
+    # One document per worker process keeps peak memory attributable
+    with multiprocessing.Pool(workers, maxtasksperchild=1) as pool:
+        for result in pool.imap_unordered(profile_pdf, pdf_files):
+            status = "❌" if result["error"] else "✅"
+            print(f"   {status} {result['file']}: {result['pages']} pages in {result['extract_seconds']:.3f}s")
+            documents.append(result)
+    wall_seconds = time.perf_counter() - started
+    
+    pages = [page for doc in documents for page in doc["page_stats"]]
+    page_times = [page["seconds"] for page in pages]
+    total_pages = len(pages)
+    total_chars = sum(doc["characters"] for doc in documents)
+    extract_seconds = sum(doc["extract_seconds"] for doc in documents)
+    
+    document_rows = []
+    for doc in documents:
+        document_rows.append({
+            "file": doc["file"],
+            "size_bytes": doc["size_bytes"],
+            "pages": doc["pages"],
+            "characters": doc["characters"],
+            "open_seconds": round(doc["open_seconds"], 6),
+            "extract_seconds": round(doc["extract_seconds"], 6),
+            "chars_per_second": round(doc["characters"] / doc["extract_seconds"], 1) if doc["extract_seconds"] > 0 else 0.0,
+            "empty_page_rate": round(doc["empty_pages"] / doc["pages"], 4) if doc["pages"] else 0.0,
+            "peak_memory_mb": doc["peak_memory_mb"],
+            "error": doc["error"]
+        })
+    
+    return {
+        "summary": {
+            "directory": directory,
+            "documents": len(documents),
+            "failed_documents": sum(1 for doc in documents if doc["error"]),
+            "pages": total_pages,
+            "characters": total_chars,
+            "wall_seconds": round(wall_seconds, 3),
+            "extract_seconds": round(extract_seconds, 3),
+            "chars_per_second": round(total_chars / extract_seconds, 1) if extract_seconds > 0 else 0.0,
+            "empty_page_rate": round(sum(1 for page in pages if page["empty"]) / total_pages, 4) if total_pages else 0.0,
+            "page_seconds_p50": percentile(page_times, 50),
+            "page_seconds_p95": percentile(page_times, 95),
+            "page_seconds_p99": percentile(page_times, 99),
+            "page_seconds_max": max(page_times) if page_times else 0.0,
+            "peak_memory_mb_max": max((doc["peak_memory_mb"] or 0 for doc in documents), default=0)
+        },
+        "slowest_documents": sorted(document_rows, key=lambda doc: doc["extract_seconds"], reverse=True)[:top],
+        "slowest_pages": sorted(pages, key=lambda page: page["seconds"], reverse=True)[:top],
+        "documents": sorted(document_rows, key=lambda doc: doc["file"]),
+        "pages": pages
+    }
+
+def write_csv(path: str, rows: List[Dict[str, Any]]):
+    if not rows:
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+def print_profile(report: Dict[str, Any]):
+    summary = report["summary"]
+    print("\n" + "=" * 50)
+    print(f"📊 {summary['documents']} documents ({summary['failed_documents']} failed), {summary['pages']} pages")
+    print(f"   Extraction: {summary['extract_seconds']}s ({summary['chars_per_second']} chars/s), wall {summary['wall_seconds']}s")
+    print(f"   Page time p50/p95/p99/max: {summary['page_seconds_p50']:.4f}/{summary['page_seconds_p95']:.4f}/"
+          f"{summary['page_seconds_p99']:.4f}/{summary['page_seconds_max']:.4f}s")
+    print(f"   Empty page rate: {summary['empty_page_rate'] * 100:.1f}%  Peak memory: {summary['peak_memory_mb_max']} MB")
+    
+    print("\n🐢 Slowest documents:")
+    for doc in report["slowest_documents"]:
+        print(f"   {doc['extract_seconds']:.3f}s  {doc['pages']:>5} pages  {doc['peak_memory_mb']} MB  {doc['file']}")
+    
+    print("\n🐢 Slowest pages:")
+    for page in report["slowest_pages"]:
+        print(f"   {page['seconds']:.4f}s  page {page['page']:>5}  {page['characters']:>7} chars  {page['file']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="StudyMate PDF extraction diagnostics and profiling")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    profile = subparsers.add_parser("profile", help="Profile extraction over a directory of PDFs")
+    profile.add_argument("directory", nargs="?", default="../uploads")
+    profile.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    profile.add_argument("--top", type=int, default=10, help="Slowest documents and pages to report")
+    profile.add_argument("--json", dest="json_path", help="Write the full report as JSON")
+    profile.add_argument("--csv", dest="csv_path", help="Write per-page timings as CSV")
+    profile.add_argument("--documents-csv", dest="documents_csv_path", help="Write per-document timings as CSV")
+    args = parser.parse_args()
+    
+    if args.command != "profile":
+        diagnose_pdf_issues()
+        return
+    
+    report = profile_corpus(args.directory, args.workers, args.top)
+    print_profile(report)
+    
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 JSON report: {args.json_path}")
+    if args.csv_path:
+        write_csv(args.csv_path, report["pages"])
+        print(f"💾 Page CSV: {args.csv_path}")
+    if args.documents_csv_path:
+        write_csv(args.documents_csv_path, report["documents"])
+        print(f"💾 Document CSV: {args.documents_csv_path}")
+
 if __name__ == "__main__":
-    diagnose_pdf_issues()
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+PDF text extraction for the StudyMate all-models server
+Kept apart from the server so its extraction workers only need PyMuPDF (or
+pdfplumber) and never import the web and model stack.
+"""
+
+import logging
+from typing import Dict, Any
+
+try:
+    import fitz  # PyMuPDF
+    PDF_LIBRARY = "PyMuPDF"
+except ImportError:
+    try:
+        import pdfplumber
+        PDF_LIBRARY = "pdfplumber"
+    except ImportError:
+        PDF_LIBRARY = None
+
+PDF_AVAILABLE = PDF_LIBRARY is not None
+
+logger = logging.getLogger(__name__)
+
+def extract_pdf_text(file_path: str) -> Dict[str, Any]:
+    """Extract text from PDF using PyMuPDF or pdfplumber"""
+    
+    logger.info(f"Extracting text from PDF: {file_path}")
+    
+    try:
+        text_chunks = []
+        full_text = ""
+        total_pages = 0
+        page_offsets = []
+        
+        # Try PyMuPDF first
+        if PDF_LIBRARY == "PyMuPDF":
+            logger.info("Using PyMuPDF for extraction")
+            doc = fitz.open(file_path)
+            total_pages = len(doc)
+            
+            for page_num in range(total_pages):
+                page = doc.load_page(page_num)
+                page_text = page.get_text()
+                page_offsets.append(len(full_text))
+                full_text += page_text + "\n"
+                
+                # Create chunks of ~1000 characters
+                chunk_size = 1000
+                for i in range(0, len(page_text), chunk_size):
+                    chunk = page_text[i:i + chunk_size].strip()
+                    if chunk:
+                        text_chunks.append({
+                            "content": chunk,
+                            "page": page_num + 1,
+                            "chunk_id": len(text_chunks)
+                        })
+            
+            doc.close()
+            logger.info(f"Extracted {len(full_text)} characters from {total_pages} pages")
+            
+        # Fallback to pdfplumber
+        elif PDF_LIBRARY == "pdfplumber":
+            logger.info("Using pdfplumber for extraction")
+            
+            with pdfplumber.open(file_path) as pdf:
+                total_pages = len(pdf.pages)
+                for page_num, page in enumerate(pdf.pages):
+                    page_text = page.extract_text() or ""
+                    page_offsets.append(len(full_text))
+                    full_text += page_text + "\n"
+                    
+                    chunk_size = 1000
+                    for i in range(0, len(page_text), chunk_size):
+                        chunk = page_text[i:i + chunk_size].strip()
+                        if chunk:
+                            text_chunks.append({
+                                "content": chunk,
+                                "page": page_num + 1,
+                                "chunk_id": len(text_chunks)
+                            })
+        
+        else:
+            raise Exception("No PDF processing library available")
+        
+        return {
+            "success": True,
+            "full_text": full_text,
+            "chunks": text_chunks,
+            "page_offsets": page_offsets,
+            "total_pages": total_pages,
+            "total_characters": len(full_text)
+        }
+        
+    except Exception as e:
+        logger.error(f"PDF extraction failed: {e}")
+        return {
+            "success": False,
+            "error": str(e),
+            "full_text": "",
+            "chunks": [],
+            "page_offsets": [],
+            "total_pages": 0,
+            "total_characters": 0
+        }
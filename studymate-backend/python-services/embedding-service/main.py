@@ -1,14 +1,19 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from sentence_transformers import SentenceTransformer
 import numpy as np
 import faiss
 import os
+import json
 import logging
+import httpx
+import zlib
+import time
 from typing import List, Dict, Any, Optional
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, ReturnDocument
 from gridfs import GridFS
-from bson import ObjectId
+from bson import Binary, ObjectId
 import asyncio
 from datetime import datetime
 from pydantic import BaseModel
@@ -33,6 +38,51 @@ MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/studymate")
 client = AsyncIOMotorClient(MONGODB_URI)
 db = client.studymate
 
+# Fused ingestion: chunks are streamed from the PDF processor and encoded in batches
+PDF_PROCESSOR_URL = os.getenv("PDF_PROCESSOR_URL", "http://localhost:5001")
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+
+# Compact chunk storage, shared with the PDF processor: "zlib" keeps chunk
+# text compressed in contentZ instead of content
+CHUNK_COMPRESSION = os.getenv("CHUNK_COMPRESSION", "none")
+CHUNK_COMPRESSION_LEVEL = int(os.getenv("CHUNK_COMPRESSION_LEVEL", "6"))
+
+# Seconds the chunk counts in /stats are served from cache
+STATS_CACHE_TTL = float(os.getenv("EMBEDDING_STATS_CACHE_TTL", "10"))
+
+# Every writer of documentchunks (this service, the PDF processor and the API)
+# bumps this counter; the cached all-documents index is rebuilt when it moves
+CHUNK_GENERATION_ID = "documentchunks"
+
+async def chunk_generation() -> int:
+    state = await db.chunkgenerations.find_one({"_id": CHUNK_GENERATION_ID})
+    return state["generation"] if state else 0
+
+async def bump_chunk_generation() -> int:
+    """Record a change to documentchunks, returning the new generation"""
+    state = await db.chunkgenerations.find_one_and_update(
+        {"_id": CHUNK_GENERATION_ID},
+        {"$inc": {"generation": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return state["generation"]
+
+def chunk_content(chunk: Dict[str, Any]) -> str:
+    """Text of a stored chunk, whichever way it was written"""
+    if chunk.get("contentEncoding") == "zlib":
+        return zlib.decompress(chunk["contentZ"]).decode("utf-8")
+    return chunk["content"]
+
+def content_fields(text: str) -> Dict[str, Any]:
+    """Chunk text fields for a new documentchunks record"""
+    if CHUNK_COMPRESSION == "zlib":
+        return {
+            "contentZ": Binary(zlib.compress(text.encode("utf-8"), CHUNK_COMPRESSION_LEVEL)),
+            "contentEncoding": "zlib"
+        }
+    return {"content": text}
+
 # Pydantic models
 class EmbeddingRequest(BaseModel):
     texts: List[str]
@@ -42,6 +92,10 @@ class SearchRequest(BaseModel):
     document_ids: Optional[List[str]] = None
     limit: int = 5
 
+class DocumentRequest(BaseModel):
+    filename: str
+    file_size: int = 0
+
 class EmbeddingService:
     def __init__(self):
         # Load sentence transformer model
@@ -54,6 +108,10 @@ class EmbeddingService:
         # Initialize FAISS index (will be built dynamically)
         self.index = None
         self.chunk_ids = []  # Keep track of chunk IDs corresponding to index positions
+        self.chunk_id_set = set()  # The same IDs, for membership checks
+        self.index_scope = None  # Document IDs the loaded index covers (None = all)
+        self.index_generation = None  # Chunk generation the all-documents index reflects
+        self.index_lock = asyncio.Lock()
         
     def generate_embeddings(self, texts: List[str]) -> np.ndarray:
         """Generate embeddings for a list of texts"""
@@ -82,6 +140,45 @@ class EmbeddingService:
             logger.error(f"Error building FAISS index: {str(e)}")
             raise e
     
+    def set_index(self, index, chunk_ids: List[str], scope: Optional[List[str]] = None, generation: Optional[int] = None):
+        self.index = index
+        self.chunk_ids = chunk_ids
+        self.chunk_id_set = set(chunk_ids)
+        self.index_scope = scope
+        self.index_generation = generation
+    
+    def add_to_index(self, chunk_ids: List[Any], embeddings: np.ndarray, generation: int):
+        """Append vectors this service just wrote to the loaded all-documents index
+        
+        generation is the chunk generation after the write. The index is only
+        updated in place if it was current just before it; if another writer
+        got in between it is left stale and rebuilt by the next search.
+        """
+        if self.index is None or self.index_scope is not None or self.index_generation != generation - 1:
+            return
+        
+        # Skip chunks that are already indexed (e.g. a document embedded twice)
+        rows = [i for i, chunk_id in enumerate(chunk_ids) if str(chunk_id) not in self.chunk_id_set]
+        if rows:
+            vectors = np.array(embeddings, dtype='float32')[rows]
+            faiss.normalize_L2(vectors)
+            self.index.add(vectors)
+            new_ids = [str(chunk_ids[i]) for i in rows]
+            self.chunk_ids.extend(new_ids)
+            self.chunk_id_set.update(new_ids)
+        self.index_generation = generation
+    
+    async def all_documents_index(self):
+        """The all-documents index, rebuilt if documentchunks changed since it was built"""
+        generation = await chunk_generation()
+        async with self.index_lock:
+            # Concurrent searches wait here and share a single rebuild
+            if (self.index is None or self.index_scope is not None
+                    or self.index_generation is None or self.index_generation < generation):
+                index, chunk_ids = await self.load_document_embeddings()
+                self.set_index(index, chunk_ids, None, generation)
+            return self.index, self.chunk_ids
+    
     async def load_document_embeddings(self, document_ids: List[str] = None):
         """Load embeddings for specific documents or all documents"""
         try:
@@ -101,7 +198,7 @@ class EmbeddingService:
                 return None, []
             
             # Extract embeddings and IDs
-            embeddings = np.array([chunk["embedding"] for chunk in chunks])
+            embeddings = np.array([chunk["embedding"] for chunk in chunks], dtype="float32")
             chunk_ids = [str(chunk["_id"]) for chunk in chunks]
             
             # Build FAISS index
@@ -119,30 +216,45 @@ class EmbeddingService:
             query_embedding = self.generate_embeddings([query])
             faiss.normalize_L2(query_embedding)
             
-            # Load or build index for specified documents
-            index, chunk_ids = await self.load_document_embeddings(document_ids)
-            
-            if index is None:
-                return []
+            for attempt in range(2):
+                # Unfiltered searches use the cached all-documents index
+                if document_ids:
+                    index, chunk_ids = await self.load_document_embeddings(document_ids)
+                else:
+                    index, chunk_ids = await self.all_documents_index()
+                
+                if index is None:
+                    return []
+                
+                # Search similar vectors
+                scores, indices = index.search(query_embedding.astype('float32'), min(limit, len(chunk_ids)))
+                hits = [(float(score), chunk_ids[idx]) for score, idx in zip(scores[0], indices[0]) if idx >= 0]
+                
+                # Get chunk details
+                chunks = await db.documentchunks.find(
+                    {"_id": {"$in": [ObjectId(chunk_id) for _, chunk_id in hits]}}
+                ).to_list(None)
+                chunks_by_id = {str(chunk["_id"]): chunk for chunk in chunks}
+                
+                if len(chunks_by_id) < len(hits) and not document_ids and attempt == 0:
+                    # Chunks deleted by a writer that didn't bump the generation
+                    logger.warning(f"{len(hits) - len(chunks_by_id)} indexed chunks no longer exist, rebuilding index")
+                    self.index_generation = None
+                    continue
+                break
             
-            # Search similar vectors
-            scores, indices = index.search(query_embedding.astype('float32'), min(limit, len(chunk_ids)))
-            
-            # Get chunk details
             similar_chunks = []
-            for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-                if idx >= 0:  # Valid index
-                    chunk_id = chunk_ids[idx]
-                    chunk = await db.documentchunks.find_one({"_id": ObjectId(chunk_id)})
-                    if chunk:
-                        similar_chunks.append({
-                            "chunk_id": chunk_id,
-                            "content": chunk["content"],
-                            "similarity_score": float(score),
-                            "page_number": chunk.get("pageNumber", 1),
-                            "chunk_index": chunk.get("chunkIndex", 0),
-                            "document_id": str(chunk["documentId"])
-                        })
+            for score, chunk_id in hits:
+                chunk = chunks_by_id.get(chunk_id)
+                if chunk:
+                    similar_chunks.append({
+                        "chunk_id": chunk_id,
+                        "content": chunk_content(chunk),
+                        "similarity_score": score,
+                        "page_number": chunk.get("pageNumber", 1),
+                        "chunk_index": chunk.get("chunkIndex", 0),
+                        "document_id": str(chunk["documentId"])
+                    })
             
             return similar_chunks
         except Exception as e:
@@ -151,6 +263,142 @@ class EmbeddingService:
 
 embedding_service = EmbeddingService()
 
+async def create_document_record(filename: str, file_size: int) -> ObjectId:
+    """Insert a processing documents record for a PDF about to be ingested"""
+    now = datetime.utcnow()
+    result = await db.documents.insert_one({
+        "filename": filename,
+        "originalName": filename,
+        "uploadDate": now,
+        "status": "processing",
+        "chunkCount": 0,
+        "metadata": {
+            "pages": 0,
+            "fileSize": file_size,
+            "extractedText": False,
+            "processingTime": 0,
+            "mimeType": "application/pdf"
+        },
+        "createdAt": now,
+        "updatedAt": now
+    })
+    return result.inserted_id
+
+async def delete_document_chunks(document_id: ObjectId) -> int:
+    result = await db.documentchunks.delete_many({"documentId": document_id})
+    if result.deleted_count:
+        await bump_chunk_generation()
+    return result.deleted_count
+
+async def ingest_pdf_stream(filename: str, content: bytes, document_id: ObjectId) -> Dict[str, Any]:
+    """Stream chunks from the PDF processor, encode them in batches and store them
+
+    The three stages run concurrently, connected by small bounded queues, so
+    page extraction, model inference and Mongo writes overlap. Chunks from an
+    earlier ingest of the document are replaced, and a failed ingest leaves
+    no chunks behind.
+    """
+    chunk_queue = asyncio.Queue(maxsize=4)
+    write_queue = asyncio.Queue(maxsize=4)
+    summary = {}
+    written = {"chunks": 0}
+    
+    async def read_chunks():
+        batch = []
+        async with httpx.AsyncClient(timeout=None) as http:
+            async with http.stream(
+                "POST",
+                f"{PDF_PROCESSOR_URL}/process-pdf",
+                params={"stream": "true"},
+                files={"file": (filename, content, "application/pdf")}
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise RuntimeError(f"PDF processor error: {response.status_code} - {response.text}")
+                
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    record = json.loads(line)
+                    if record["type"] == "error":
+                        raise RuntimeError(record["error"])
+                    if record["type"] == "summary":
+                        summary.update(record)
+                        continue
+                    
+                    # Page, flush and ocr (scanned pages) records all carry chunks
+                    for chunk in record["chunks"]:
+                        batch.append(chunk)
+                        if len(batch) >= INGEST_BATCH_SIZE:
+                            await chunk_queue.put(batch)
+                            batch = []
+        
+        if batch:
+            await chunk_queue.put(batch)
+        await chunk_queue.put(None)
+    
+    async def encode_batches():
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await chunk_queue.get()
+            if batch is None:
+                break
+            texts = [chunk["content"] for chunk in batch]
+            embeddings = await loop.run_in_executor(None, embedding_service.generate_embeddings, texts)
+            await write_queue.put((batch, embeddings))
+        await write_queue.put(None)
+    
+    async def write_batches():
+        while True:
+            item = await write_queue.get()
+            if item is None:
+                break
+            batch, embeddings = item
+            chunk_documents = [
+                {
+                    "documentId": document_id,
+                    **content_fields(chunk["content"]),
+                    "chunkIndex": chunk["chunk_index"],
+                    "pageNumber": chunk["page_number"],
+                    "startPosition": chunk["start_position"],
+                    "endPosition": chunk["end_position"],
+                    "metadata": chunk["metadata"],
+                    "embedding": embedding.tolist(),
+                    "createdAt": datetime.utcnow()
+                }
+                for chunk, embedding in zip(batch, embeddings)
+            ]
+            result = await db.documentchunks.insert_many(chunk_documents, ordered=False)
+            generation = await bump_chunk_generation()
+            embedding_service.add_to_index(result.inserted_ids, embeddings, generation)
+            written["chunks"] += len(chunk_documents)
+    
+    replaced = await delete_document_chunks(document_id)
+    if replaced:
+        logger.info(f"Replacing {replaced} chunks from an earlier ingest of {document_id}")
+    
+    tasks = [
+        asyncio.create_task(read_chunks()),
+        asyncio.create_task(encode_batches()),
+        asyncio.create_task(write_batches())
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Don't leave the batches written before the failure behind
+        await delete_document_chunks(document_id)
+        raise
+    
+    return {
+        "total_pages": summary.get("total_pages", 0),
+        "total_characters": summary.get("total_characters", 0),
+        "total_chunks": written["chunks"],
+        "ocr_pages": summary.get("ocr_pages", [])
+    }
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -162,6 +410,15 @@ async def health_check():
         "timestamp": datetime.utcnow().isoformat()
     }
 
+@app.get("/chunk-generation")
+async def get_chunk_generation():
+    """Current documentchunks generation, for callers caching anything derived from chunks"""
+    try:
+        return {"generation": await chunk_generation()}
+    except Exception as e:
+        logger.error(f"Error reading chunk generation: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/generate-embeddings")
 async def generate_embeddings(request: EmbeddingRequest):
     """Generate embeddings for a list of texts"""
@@ -182,20 +439,32 @@ async def generate_embeddings(request: EmbeddingRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/embed-document-chunks/{document_id}")
-async def embed_document_chunks(document_id: str):
-    """Generate and store embeddings for all chunks of a document"""
+async def embed_document_chunks(document_id: str, missing_only: bool = False):
+    """Generate and store embeddings for all chunks of a document
+    
+    missing_only=true embeds just the chunks without an embedding, e.g. the
+    pages re-chunked by an incremental re-process.
+    """
     try:
         # Get document chunks
-        chunks = await db.documentchunks.find(
-            {"documentId": ObjectId(document_id)},
-            {"_id": 1, "content": 1}
-        ).to_list(None)
+        query = {"documentId": ObjectId(document_id)}
+        if missing_only:
+            query["$or"] = [{"embedding": {"$exists": False}}, {"embedding": []}]
+        
+        chunks = await db.documentchunks.find(query, {"_id": 1, "content": 1, "contentZ": 1, "contentEncoding": 1}).to_list(None)
         
         if not chunks:
+            if missing_only:
+                return {
+                    "success": True,
+                    "document_id": document_id,
+                    "chunks_processed": 0,
+                    "embedding_dimension": embedding_service.embedding_dim
+                }
             raise HTTPException(status_code=404, detail="No chunks found for document")
         
         # Extract texts
-        texts = [chunk["content"] for chunk in chunks]
+        texts = [chunk_content(chunk) for chunk in chunks]
         chunk_ids = [chunk["_id"] for chunk in chunks]
         
         # Generate embeddings
@@ -204,16 +473,15 @@ async def embed_document_chunks(document_id: str):
         # Update chunks with embeddings
         update_operations = []
         for chunk_id, embedding in zip(chunk_ids, embeddings):
-            update_operations.append({
-                "updateOne": {
-                    "filter": {"_id": chunk_id},
-                    "update": {"$set": {"embedding": embedding.tolist()}}
-                }
-            })
+            update_operations.append(
+                UpdateOne({"_id": chunk_id}, {"$set": {"embedding": embedding.tolist()}})
+            )
         
         # Bulk update
         if update_operations:
             await db.documentchunks.bulk_write(update_operations)
+            generation = await bump_chunk_generation()
+            embedding_service.add_to_index(chunk_ids, embeddings, generation)
         
         logger.info(f"Generated embeddings for {len(chunks)} chunks in document {document_id}")
         
@@ -227,6 +495,70 @@ async def embed_document_chunks(document_id: str):
         logger.error(f"Error embedding document chunks: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/documents")
+async def create_document(request: DocumentRequest):
+    """Create the documents record for a PDF before it is ingested"""
+    try:
+        document_id = await create_document_record(request.filename, request.file_size)
+        return {"success": True, "document_id": str(document_id)}
+    except Exception as e:
+        logger.error(f"Error creating document record: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/ingest-pdf")
+async def ingest_pdf(file: UploadFile = File(...), document_id: Optional[str] = None):
+    """Extract, chunk, embed and index a PDF in one pipelined pass
+    
+    Without a document_id a documents record is created first, so the
+    chunks always belong to a document that can be listed and deleted.
+    """
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    if document_id and not ObjectId.is_valid(document_id):
+        raise HTTPException(status_code=400, detail="Invalid document ID")
+    
+    target_id = None
+    started = datetime.utcnow()
+    
+    try:
+        content = await file.read()
+        target_id = ObjectId(document_id) if document_id else await create_document_record(file.filename, len(content))
+        result = await ingest_pdf_stream(file.filename, content, target_id)
+        processing_ms = int((datetime.utcnow() - started).total_seconds() * 1000)
+        
+        await db.documents.update_one(
+            {"_id": target_id},
+            {
+                "$set": {
+                    "status": "ready",
+                    "chunkCount": result["total_chunks"],
+                    "metadata.pages": result["total_pages"],
+                    "metadata.extractedText": True,
+                    "metadata.ocrPages": len(result["ocr_pages"]),
+                    "metadata.processingTime": processing_ms
+                }
+            }
+        )
+        
+        logger.info(f"Ingested {file.filename}: {result['total_chunks']} chunks in {processing_ms} ms")
+        
+        return {
+            "success": True,
+            "filename": file.filename,
+            "document_id": str(target_id),
+            "total_pages": result["total_pages"],
+            "total_characters": result["total_characters"],
+            "total_chunks": result["total_chunks"],
+            "ocr_pages": result["ocr_pages"],
+            "embedding_dimension": embedding_service.embedding_dim,
+            "processing_time_ms": processing_ms
+        }
+    except Exception as e:
+        logger.error(f"Error ingesting PDF {file.filename}: {str(e)}")
+        if target_id is not None:
+            await db.documents.update_one({"_id": target_id}, {"$set": {"status": "failed", "chunkCount": 0}})
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/search-similar")
 async def search_similar(request: SearchRequest):
     """Search for similar chunks using semantic similarity"""
@@ -254,6 +586,7 @@ async def search_similar(request: SearchRequest):
 async def build_search_index(document_ids: Optional[List[str]] = None):
     """Build or rebuild FAISS search index for specified documents"""
     try:
+        generation = await chunk_generation()
         index, chunk_ids = await embedding_service.load_document_embeddings(document_ids)
         
         if index is None:
@@ -263,8 +596,7 @@ async def build_search_index(document_ids: Optional[List[str]] = None):
             }
         
         # Store index in service (in production, you might want to persist this)
-        embedding_service.index = index
-        embedding_service.chunk_ids = chunk_ids
+        embedding_service.set_index(index, chunk_ids, document_ids, None if document_ids else generation)
         
         return {
             "success": True,
@@ -276,22 +608,39 @@ async def build_search_index(document_ids: Optional[List[str]] = None):
         logger.error(f"Error building search index: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Chunk counts, refreshed at most once per STATS_CACHE_TTL
+stats_cache = {"counts": None, "expires": 0.0}
+stats_lock = asyncio.Lock()
+
+async def chunk_counts() -> Dict[str, int]:
+    """Count chunks, embedded chunks and embedded documents in one $facet pass"""
+    async with stats_lock:
+        # Concurrent pollers wait here and share a single refresh
+        if stats_cache["counts"] is None or time.monotonic() >= stats_cache["expires"]:
+            embedded = {"embedding": {"$exists": True, "$ne": []}}
+            pipeline = [
+                {"$facet": {
+                    "total": [{"$count": "n"}],
+                    "embedded": [{"$match": embedded}, {"$count": "n"}],
+                    "documents": [{"$match": embedded}, {"$group": {"_id": "$documentId"}}, {"$count": "n"}]
+                }}
+            ]
+            result = (await db.documentchunks.aggregate(pipeline).to_list(1))[0]
+            stats_cache["counts"] = {
+                name: result[name][0]["n"] if result[name] else 0
+                for name in ("total", "embedded", "documents")
+            }
+            stats_cache["expires"] = time.monotonic() + STATS_CACHE_TTL
+        return stats_cache["counts"]
+
 @app.get("/stats")
 async def get_stats():
     """Get embedding service statistics"""
     try:
-        # Count chunks with embeddings
-        total_chunks = await db.documentchunks.count_documents({})
-        embedded_chunks = await db.documentchunks.count_documents({"embedding": {"$exists": True, "$ne": []}})
-        
-        # Count documents with embedded chunks
-        pipeline = [
-            {"$match": {"embedding": {"$exists": True, "$ne": []}}},
-            {"$group": {"_id": "$documentId"}},
-            {"$count": "total"}
-        ]
-        embedded_docs_result = await db.documentchunks.aggregate(pipeline).to_list(1)
-        embedded_documents = embedded_docs_result[0]["total"] if embedded_docs_result else 0
+        counts = await chunk_counts()
+        total_chunks = counts["total"]
+        embedded_chunks = counts["embedded"]
+        embedded_documents = counts["documents"]
         
         return {
             "total_chunks": total_chunks,
@@ -316,6 +665,10 @@ async def delete_document_embeddings(document_id: str):
             {"$unset": {"embedding": ""}}
         )
         
+        # Removing vectors from a flat index isn't supported; the next search rebuilds it
+        if result.modified_count:
+            await bump_chunk_generation()
+        
         return {
             "success": True,
             "document_id": document_id,
@@ -0,0 +1,76 @@
+"""
+Background batch writer for chunk records.
+
+Records are grouped into fixed-size batches and inserted with unordered
+insert_many calls on a writer thread, so the producer (page extraction and
+chunking) keeps running while the previous batch is on the wire. At most
+max_pending batches are buffered, which bounds memory for large books.
+"""
+
+import queue
+import threading
+import time
+from typing import Any, Dict, List
+
+class BatchWriter:
+    def __init__(self, collection, batch_size: int = 500, max_pending: int = 2):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.batch = []
+        self.error = None
+
+        self.records_written = 0
+        self.batches_written = 0
+        self.write_seconds = 0.0
+
+        self.thread = threading.Thread(target=self._run, name="chunk-writer", daemon=True)
+        self.thread.start()
+
+    def add(self, record: Dict[str, Any]):
+        if self.error is not None:
+            raise self.error
+        self.batch.append(record)
+        if len(self.batch) >= self.batch_size:
+            self.pending.put(self.batch)
+            self.batch = []
+
+    def close(self) -> Dict[str, Any]:
+        """Flush the last batch, wait for the writer and return write statistics"""
+        if self.batch and self.error is None:
+            self.pending.put(self.batch)
+            self.batch = []
+        self.pending.put(None)
+        self.thread.join()
+
+        if self.error is not None:
+            raise self.error
+        return self.stats()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "records": self.records_written,
+            "batches": self.batches_written,
+            "seconds": round(self.write_seconds, 4),
+            "records_per_second": round(self.records_written / self.write_seconds, 1) if self.write_seconds else 0.0
+        }
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        started = time.perf_counter()
+        self.collection.insert_many(batch, ordered=False)
+        self.write_seconds += time.perf_counter() - started
+        self.records_written += len(batch)
+        self.batches_written += 1
+
+    def _run(self):
+        while True:
+            batch = self.pending.get()
+            if batch is None:
+                return
+            if self.error is not None:
+                # Keep draining so the producer never blocks on a dead writer
+                continue
+            try:
+                self._write(batch)
+            except Exception as e:
+                self.error = e
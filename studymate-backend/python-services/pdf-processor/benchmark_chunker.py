@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Chunker micro-benchmark for the StudyMate PDF processor
+Compares the boundary-indexed DocumentChunker with the original rfind-based chunker
+"""
+
+import argparse
+import random
+import time
+from typing import List, Dict, Any
+
+from chunker import DocumentChunker
+
+WORDS = (
+    "the of and to in is that for it as with was on be by this are from or an "
+    "study notes lecture chapter theorem proof example exercise equation graph "
+    "function variable matrix vector energy cell protein history economy market"
+).split()
+
+def legacy_create_chunks(text: str, page_number: int = 1, chunk_size: int = 1000, overlap: int = 200) -> List[Dict[str, Any]]:
+    """Original PDFProcessor.create_chunks, kept here as the baseline"""
+    chunks = []
+    start = 0
+    chunk_index = 0
+
+    while start < len(text):
+        end = start + chunk_size
+
+        if end < len(text):
+            sentence_end = text.rfind('.', start, end)
+            if sentence_end > start + chunk_size // 2:
+                end = sentence_end + 1
+            else:
+                word_end = text.rfind(' ', start, end)
+                if word_end > start + chunk_size // 2:
+                    end = word_end
+
+        chunk_text = text[start:end].strip()
+
+        if chunk_text:
+            chunks.append({
+                "content": chunk_text,
+                "chunk_index": chunk_index,
+                "page_number": page_number,
+                "start_position": start,
+                "end_position": end,
+                "metadata": {
+                    "word_count": len(chunk_text.split()),
+                    "character_count": len(chunk_text),
+                    "confidence": 1.0
+                }
+            })
+            chunk_index += 1
+
+        start = max(start + 1, end - overlap)
+
+        if start >= len(text):
+            break
+
+    return chunks
+
+def generate_pages(page_count: int, chars_per_page: int, seed: int) -> List[Dict[str, Any]]:
+    """Generate reproducible page texts made of short sentences"""
+    rng = random.Random(seed)
+    pages = []
+
+    for page_num in range(page_count):
+        sentences = []
+        length = 0
+        while length < chars_per_page:
+            words = [rng.choice(WORDS) for _ in range(rng.randint(6, 24))]
+            sentence = " ".join(words).capitalize() + "."
+            sentences.append(sentence)
+            length += len(sentence) + 1
+        text = " ".join(sentences)
+        pages.append({"page_number": page_num + 1, "text": text, "char_count": len(text)})
+
+    return pages
+
+def time_it(label: str, func, repeat: int):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    print(f"  {label:<32} {best * 1000:9.2f} ms  ({len(result)} chunks)")
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDF text chunking")
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--chars-per-page", type=int, default=3000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--overlap", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    pages = generate_pages(args.pages, args.chars_per_page, args.seed)
+    total_chars = sum(page["char_count"] for page in pages)
+
+    print("🚀 StudyMate Chunker Benchmark")
+    print("=" * 60)
+    print(f"  Pages: {args.pages}  Characters: {total_chars}  Chunk size: {args.chunk_size}  Overlap: {args.overlap}")
+    print()
+
+    def legacy():
+        chunks = []
+        for page in pages:
+            chunks.extend(legacy_create_chunks(page["text"], page["page_number"], args.chunk_size, args.overlap))
+        return chunks
+
+    per_page = DocumentChunker(args.chunk_size, args.overlap, cross_page=False)
+    cross_page = DocumentChunker(args.chunk_size, args.overlap, cross_page=True)
+    token_size = max(2, args.chunk_size // 6)
+    tokens = DocumentChunker(token_size, token_size // 5, unit="tokens", cross_page=True)
+
+    legacy_time, legacy_chunks = time_it("legacy rfind (per page)", legacy, args.repeat)
+    indexed_time, indexed_chunks = time_it("boundary index (per page)", lambda: per_page.chunk_pages(pages), args.repeat)
+    time_it("boundary index (cross page)", lambda: cross_page.chunk_pages(pages), args.repeat)
+    time_it(f"boundary index ({token_size} tokens)", lambda: tokens.chunk_pages(pages), args.repeat)
+
+    # Per-page output must match the legacy chunker exactly (apart from global indices)
+    matches = len(legacy_chunks) == len(indexed_chunks) and all(
+        (a["content"], a["start_position"], a["end_position"], a["metadata"]) ==
+        (b["content"], b["start_position"], b["end_position"], b["metadata"])
+        for a, b in zip(legacy_chunks, indexed_chunks)
+    )
+
+    print()
+    print(f"  Speedup (per page): {legacy_time / indexed_time:.2f}x")
+    print(f"  Output identical to legacy: {'✅' if matches else '❌'}")
+
+if __name__ == "__main__":
+    main()
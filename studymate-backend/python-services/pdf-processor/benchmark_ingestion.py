@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Ingestion benchmark suite for the StudyMate PDF processor
+Generates a reproducible synthetic PDF corpus and measures the throughput of
+extraction, chunking, embedding and index build, fully offline
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from typing import List, Dict, Any, Optional
+
+import fitz  # PyMuPDF
+
+from benchmark_chunker import generate_pages
+from main import PDFProcessor
+
+# Never reach out to the Hugging Face hub during a benchmark (read at import)
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+# Embedding and index stages need the embedding service's dependencies and a
+# locally cached model; without them those stages are skipped
+try:
+    import faiss
+    from sentence_transformers import SentenceTransformer
+    EMBEDDING_AVAILABLE = True
+except ImportError:
+    EMBEDDING_AVAILABLE = False
+
+def create_synthetic_pdf(pdf_path: str, page_count: int, chars_per_page: int,
+                         image_only_ratio: float, seed: int):
+    """Write a PDF of generated text pages, some of them rendered as images only
+
+    Follows pdf_debug.create_test_pdf, with text flowed into a box so pages
+    look like real prose. Image-only pages are the text page rasterised and
+    re-inserted as a picture, like a scanned page.
+    """
+    rng = random.Random(seed)
+    pages = generate_pages(page_count, chars_per_page, seed)
+
+    doc = fitz.open()
+    scratch = fitz.open()
+    for page_data in pages:
+        page = doc.new_page()
+        box = page.rect + (50, 50, -50, -50)
+
+        if rng.random() < image_only_ratio:
+            scan = scratch.new_page()
+            scan.insert_textbox(box, page_data["text"], fontsize=9)
+            page.insert_image(page.rect, pixmap=scan.get_pixmap(dpi=100))
+        else:
+            page.insert_textbox(box, page_data["text"], fontsize=9)
+
+    doc.save(pdf_path, garbage=3, deflate=True)
+    doc.close()
+    scratch.close()
+
+def generate_corpus(corpus_dir: str, documents: int, pages: int, chars_per_page: int,
+                    image_only_ratio: float, seed: int) -> List[str]:
+    """Generate (or reuse) the corpus for these parameters"""
+    name = f"corpus-{documents}x{pages}-{chars_per_page}c-{image_only_ratio}img-seed{seed}"
+    target = os.path.join(corpus_dir, name)
+    os.makedirs(target, exist_ok=True)
+
+    paths = []
+    for doc_num in range(documents):
+        pdf_path = os.path.join(target, f"doc-{doc_num:04d}.pdf")
+        if not os.path.exists(pdf_path):
+            create_synthetic_pdf(pdf_path, pages, chars_per_page, image_only_ratio, seed + doc_num)
+        paths.append(pdf_path)
+    return paths
+
+def stage(label: str, seconds: float, pages: int, chunks: int) -> Dict[str, Any]:
+    result = {
+        "stage": label,
+        "seconds": round(seconds, 4),
+        "pages_per_second": round(pages / seconds, 1) if seconds > 0 else 0.0,
+        "chunks_per_second": round(chunks / seconds, 1) if seconds > 0 else 0.0
+    }
+    print(f"  {label:<14} {seconds:9.3f} s  {result['pages_per_second']:>10} pages/s  {result['chunks_per_second']:>10} chunks/s")
+    return result
+
+def best_of(func, repeat: int):
+    """Run func repeat times, returning the fastest time and the last result"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+def run_benchmark(pdf_paths: List[str], model_name: Optional[str], repeat: int = 3) -> Dict[str, Any]:
+    processor = PDFProcessor()
+
+    # Extraction
+    extract_seconds, documents = best_of(
+        lambda: [list(processor.iter_pages(path)) for path in pdf_paths], repeat
+    )
+
+    page_total = sum(len(pages) for pages in documents)
+    image_only = sum(1 for pages in documents for page in pages if page["image_only"])
+
+    # Chunking
+    chunk_seconds, chunked = best_of(
+        lambda: [processor.process_pdf_pages(pages) for pages in documents], repeat
+    )
+
+    chunks = [chunk["content"] for doc_chunks in chunked for chunk in doc_chunks]
+
+    print(f"  Documents: {len(pdf_paths)}  Pages: {page_total} ({image_only} image-only)  Chunks: {len(chunks)}")
+    print()
+
+    stages = [
+        stage("extraction", extract_seconds, page_total, len(chunks)),
+        stage("chunking", chunk_seconds, page_total, len(chunks))
+    ]
+
+    if model_name and EMBEDDING_AVAILABLE and chunks:
+        model = SentenceTransformer(model_name)
+
+        started = time.perf_counter()
+        embeddings = model.encode(chunks, convert_to_numpy=True).astype("float32")
+        stages.append(stage("embedding", time.perf_counter() - started, page_total, len(chunks)))
+
+        # Same index the embedding service builds
+        started = time.perf_counter()
+        faiss.normalize_L2(embeddings)
+        index = faiss.IndexFlatIP(embeddings.shape[1])
+        index.add(embeddings)
+        stages.append(stage("index build", time.perf_counter() - started, page_total, len(chunks)))
+    elif model_name:
+        print("  embedding / index build skipped (sentence-transformers or faiss not installed)")
+
+    total_seconds = sum(result["seconds"] for result in stages)
+    print()
+    stages.append(stage("end to end", total_seconds, page_total, len(chunks)))
+
+    return {
+        "documents": len(pdf_paths),
+        "pages": page_total,
+        "image_only_pages": image_only,
+        "chunks": len(chunks),
+        "stages": stages
+    }
+
+def compare(report: Dict[str, Any], baseline_path: str):
+    """Print the throughput change against an earlier JSON report"""
+    with open(baseline_path) as f:
+        baseline = {result["stage"]: result for result in json.load(f)["results"]["stages"]}
+
+    print()
+    print(f"  Compared with {baseline_path}:")
+    for result in report["results"]["stages"]:
+        previous = baseline.get(result["stage"])
+        if not previous or not previous["pages_per_second"]:
+            continue
+        change = (result["pages_per_second"] / previous["pages_per_second"] - 1) * 100
+        marker = "⚠️ " if change < -10 else "  "
+        print(f"  {marker}{result['stage']:<14} {change:+7.1f}% pages/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDF ingestion on a synthetic corpus")
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=50, help="Pages per document")
+    parser.add_argument("--chars-per-page", type=int, default=3000)
+    parser.add_argument("--image-only-ratio", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "studymate-benchmark"))
+    parser.add_argument("--model", default="all-MiniLM-L6-v2", help="Embedding model (must be cached locally)")
+    parser.add_argument("--skip-embedding", action="store_true")
+    parser.add_argument("--repeat", type=int, default=3, help="Best-of runs for extraction and chunking")
+    parser.add_argument("--json", dest="json_path", help="Write results as JSON")
+    parser.add_argument("--baseline", help="JSON report of an earlier run to compare against")
+    args = parser.parse_args()
+
+    print("🚀 StudyMate Ingestion Benchmark")
+    print("=" * 60)
+
+    started = time.perf_counter()
+    pdf_paths = generate_corpus(args.corpus_dir, args.documents, args.pages, args.chars_per_page,
+                                args.image_only_ratio, args.seed)
+    print(f"  Corpus ready in {time.perf_counter() - started:.2f}s: {os.path.dirname(pdf_paths[0])}")
+
+    results = run_benchmark(pdf_paths, None if args.skip_embedding else args.model, args.repeat)
+    report = {
+        "parameters": {
+            "documents": args.documents,
+            "pages": args.pages,
+            "chars_per_page": args.chars_per_page,
+            "image_only_ratio": args.image_only_ratio,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "model": None if args.skip_embedding else args.model
+        },
+        "results": results
+    }
+
+    if args.baseline:
+        compare(report, args.baseline)
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Results: {args.json_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Boundary-indexed text chunking for the StudyMate PDF processor.
+
+Word starts and token boundaries are located at most once per document, so
+a chunk's word count is a popcount over a bitset of the text instead of
+splitting the chunk, and token-sized cuts are bisect lookups. Sentence and
+word cuts stay str.rfind scans of the chunk window, which are cheaper than
+indexing every boundary up front.
+Pages can optionally be chunked together, letting chunks run across page
+breaks while recording the page span they cover.
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+TOKEN_PATTERN = re.compile(r'\S+')
+
+# Whitespace as str.split sees it: non-ASCII whitespace becomes a space before
+# encoding, then every byte maps to b"0" (whitespace) or b"1" (anything else)
+UNICODE_SPACES = {code: " " for code in range(0x80, 0x3001) if chr(code).isspace()}
+WORD_BITS_TABLE = bytes(0x30 if chr(code).isspace() else 0x31 for code in range(256))
+
+class BoundaryIndex:
+    """Word and token boundaries for one piece of text, indexed on first use"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self._word_bits = None
+        self._token_starts = None
+        self._token_ends = None
+
+    @property
+    def word_bits(self) -> int:
+        """One bit per non-whitespace character, the first character in the highest bit"""
+        if self._word_bits is None:
+            text = self.text if self.text.isascii() else self.text.translate(UNICODE_SPACES)
+            # Each remaining non-ASCII character encodes as a single "?", so offsets are kept
+            self._word_bits = int(b"0" + text.encode("ascii", "replace").translate(WORD_BITS_TABLE), 2)
+        return self._word_bits
+
+    def word_count(self, start: int, end: int) -> int:
+        """Number of words in text[start:end], equal to len(text[start:end].split())"""
+        end = min(end, len(self.text))
+        if start >= end:
+            return 0
+        bits = (self.word_bits >> (len(self.text) - end)) & ((1 << (end - start)) - 1)
+        # A word starts wherever a set bit has no set bit before it
+        return (bits & ~(bits >> 1)).bit_count()
+
+    @property
+    def has_tokens(self) -> bool:
+        return self._token_starts is not None
+
+    @property
+    def token_starts(self) -> List[int]:
+        if self._token_starts is None:
+            self._index_tokens()
+        return self._token_starts
+
+    @property
+    def token_ends(self) -> List[int]:
+        if self._token_ends is None:
+            self._index_tokens()
+        return self._token_ends
+
+    def _index_tokens(self):
+        self._token_starts = []
+        self._token_ends = []
+        for m in TOKEN_PATTERN.finditer(self.text):
+            self._token_starts.append(m.start())
+            self._token_ends.append(m.end())
+
+    def token_count(self, start: int, end: int) -> int:
+        """Number of whitespace tokens overlapping text[start:end]"""
+        return bisect_left(self.token_starts, end) - bisect_right(self.token_ends, start)
+
+class DocumentChunker:
+    """Splits text into overlapping chunks sized in characters or tokens"""
+
+    def __init__(self, chunk_size: int = 1000, overlap: int = 200, unit: str = "chars", cross_page: bool = False):
+        if unit not in ("chars", "tokens"):
+            raise ValueError(f"Unsupported chunk unit: {unit}")
+        if overlap >= chunk_size:
+            raise ValueError("Chunk overlap must be smaller than chunk size")
+
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.unit = unit
+        self.cross_page = cross_page
+
+    def _char_spans(self, index: BoundaryIndex, partial: bool = False):
+        """Yield (start, end, resume) spans using character-based sizing
+
+        With partial=True the text may still grow, so spans that reach the end
+        of the text are held back; resume is where chunking continues after a span.
+        """
+        text = index.text
+        text_length = len(text)
+        half = self.chunk_size // 2
+        start = 0
+
+        while start < text_length:
+            end = start + self.chunk_size
+
+            # If this isn't the last chunk, try to break at a sentence or word boundary
+            if end < text_length:
+                sentence_end = text.rfind('.', start, end)
+                if sentence_end > start + half:
+                    end = sentence_end + 1
+                else:
+                    word_end = text.rfind(' ', start, end)
+                    if word_end > start + half:
+                        end = word_end
+            elif partial:
+                return
+
+            # Move start position with overlap
+            resume = max(start + 1, end - self.overlap)
+            yield start, end, resume
+            start = resume
+
+    def _token_spans(self, index: BoundaryIndex, partial: bool = False):
+        """Yield (start, end, resume) spans using token-count sizing"""
+        token_total = len(index.token_starts)
+        half = self.chunk_size // 2
+        first = 0
+
+        while first < token_total:
+            last = min(first + self.chunk_size, token_total)
+            start = index.token_starts[first]
+            end = index.token_ends[last - 1]
+
+            # Prefer ending on a sentence boundary in the second half of the window
+            if last < token_total:
+                sentence_end = index.text.rfind('.', index.token_starts[first + half], end)
+                if sentence_end >= 0:
+                    end = sentence_end + 1
+                    last = bisect_right(index.token_starts, sentence_end)
+            elif partial:
+                return
+
+            next_first = max(first + 1, last - self.overlap)
+            resume = index.token_starts[next_first] if next_first < token_total else len(index.text)
+            yield start, end, resume
+
+            if last >= token_total:
+                break
+            first = next_first
+
+    def _spans(self, index: BoundaryIndex, partial: bool = False):
+        if self.unit == "tokens":
+            return self._token_spans(index, partial)
+        return self._char_spans(index, partial)
+
+    @staticmethod
+    def _word_count(index: BoundaryIndex, start: int, end: int) -> int:
+        # Reuse the token index when token sizing already built it
+        if index.has_tokens:
+            return index.token_count(start, end)
+        return index.word_count(start, end)
+
+    def chunk_text(self, text: str, page_number: int = 1) -> List[Dict[str, Any]]:
+        """Split a single page of text into overlapping chunks"""
+        index = BoundaryIndex(text)
+        chunks = []
+
+        for start, end, _ in self._spans(index):
+            chunk_text = text[start:end].strip()
+            if not chunk_text:
+                continue
+
+            chunks.append({
+                "content": chunk_text,
+                "chunk_index": len(chunks),
+                "page_number": page_number,
+                "start_position": start,
+                "end_position": end,
+                "metadata": {
+                    "word_count": self._word_count(index, start, end),
+                    "character_count": len(chunk_text),
+                    "confidence": 1.0
+                }
+            })
+
+        return chunks
+
+    def chunk_pages(self, pages_data: List[Dict]) -> List[Dict[str, Any]]:
+        """Chunk extracted pages, across page breaks unless cross_page is off"""
+        all_chunks = []
+        for _, chunks in self.iter_page_chunks(pages_data):
+            all_chunks.extend(chunks)
+        return all_chunks
+
+    def iter_page_chunks(self, pages: Iterable[Dict]) -> Iterator[Tuple[Optional[int], List[Dict[str, Any]]]]:
+        """Chunk pages as they arrive, yielding (page_number, chunks) after each page
+
+        Cross-page chunks are only emitted once the text they cover is complete,
+        so a page may yield chunks that started on earlier pages, or none at all.
+        A final (None, chunks) pair flushes whatever is left after the last page.
+        """
+        chunk_index = 0
+
+        if not self.cross_page:
+            for page_data in pages:
+                chunks = self.chunk_text(page_data["text"], page_data["page_number"])
+                for chunk in chunks:
+                    chunk["chunk_index"] = chunk_index
+                    chunk_index += 1
+                yield page_data["page_number"], chunks
+            return
+
+        # Only the unchunked tail of the document is kept; base is its offset
+        # in the joined text, page_offsets are offsets in the joined text too
+        buffer = ""
+        base = 0
+        page_offsets = []
+        page_numbers = []
+
+        def emit(partial: bool):
+            nonlocal buffer, base, chunk_index
+            index = BoundaryIndex(buffer)
+            chunks = []
+            consumed = 0
+
+            for start, end, resume in self._spans(index, partial):
+                consumed = resume
+                chunk_text = buffer[start:end].strip()
+                if not chunk_text:
+                    continue
+
+                doc_start = base + start
+                doc_end = base + end
+                page_start = page_numbers[bisect_right(page_offsets, doc_start) - 1]
+                page_end = page_numbers[bisect_right(page_offsets, max(doc_start, doc_end - 1)) - 1]
+
+                chunks.append({
+                    "content": chunk_text,
+                    "chunk_index": chunk_index,
+                    "page_number": page_start,
+                    "start_position": doc_start,
+                    "end_position": doc_end,
+                    "metadata": {
+                        "word_count": self._word_count(index, start, end),
+                        "character_count": len(chunk_text),
+                        "confidence": 1.0,
+                        "page_start": page_start,
+                        "page_end": page_end
+                    }
+                })
+                chunk_index += 1
+
+            buffer = buffer[consumed:]
+            base += consumed
+            return chunks
+
+        for page_data in pages:
+            if page_numbers:
+                buffer += "\n"
+            page_offsets.append(base + len(buffer))
+            page_numbers.append(page_data["page_number"])
+            buffer += page_data["text"]
+            yield page_data["page_number"], emit(partial=True)
+
+        if page_numbers:
+            yield None, emit(partial=False)
@@ -0,0 +1,138 @@
+"""
+In-process ingestion job queue for the StudyMate PDF processor.
+
+Jobs wait in a priority queue (smallest documents first) and are run by a
+fixed number of asyncio workers. Submissions are rejected once the queue is
+full so callers can back off instead of piling up work.
+"""
+
+import asyncio
+import itertools
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+class JobQueue:
+    def __init__(self, handler: Callable[..., Awaitable[Dict[str, Any]]], workers: int = 2,
+                 max_depth: int = 100, history_size: int = 1000):
+        self.handler = handler
+        self.worker_count = workers
+        self.max_depth = max_depth
+        self.history_size = history_size
+
+        self.queue = None
+        self.workers = []
+        self.jobs = OrderedDict()
+        self.waiters = {}
+        self.sequence = itertools.count()
+        self.running = 0
+
+    def start(self):
+        """Start the worker tasks (must be called from the running event loop)"""
+        self.queue = asyncio.PriorityQueue()
+        self.workers = [
+            asyncio.create_task(self._worker(n)) for n in range(self.worker_count)
+        ]
+        logger.info(f"Ingestion queue started with {self.worker_count} workers (max depth {self.max_depth})")
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def depth(self) -> int:
+        return self.queue.qsize() if self.queue else 0
+
+    def submit(self, job_id: str, priority: int = 0, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Queue a job, or return the existing one if it is still pending
+
+        options are passed to the handler as keyword arguments.
+        """
+        existing = self.jobs.get(job_id)
+        if existing and existing["state"] in ("queued", "running"):
+            return existing
+
+        if self.depth() >= self.max_depth:
+            raise QueueFullError(f"Ingestion queue is full ({self.max_depth} jobs)")
+
+        job = {
+            "job_id": job_id,
+            "state": "queued",
+            "priority": priority,
+            "options": options or {},
+            "enqueued_at": datetime.utcnow().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None
+        }
+        self.jobs[job_id] = job
+        self.jobs.move_to_end(job_id)
+        self.waiters[job_id] = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((priority, next(self.sequence), job_id))
+        self._trim_history()
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.jobs.get(job_id)
+
+    async def wait(self, job_id: str) -> Dict[str, Any]:
+        """Wait until a submitted job has finished"""
+        waiter = self.waiters.get(job_id)
+        if waiter is not None:
+            await asyncio.shield(waiter)
+        return self.jobs[job_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.worker_count,
+            "running": self.running,
+            "queued": self.depth(),
+            "max_depth": self.max_depth
+        }
+
+    def _trim_history(self):
+        # Forget the oldest finished jobs; pending ones are always kept
+        excess = len(self.jobs) - self.history_size
+        for job_id in list(self.jobs):
+            if excess <= 0:
+                break
+            if self.jobs[job_id]["state"] in ("ready", "failed"):
+                del self.jobs[job_id]
+                excess -= 1
+
+    async def _worker(self, worker_number: int):
+        while True:
+            _, _, job_id = await self.queue.get()
+            job = self.jobs.get(job_id)
+            if job is None:
+                self.queue.task_done()
+                continue
+
+            job["state"] = "running"
+            job["started_at"] = datetime.utcnow().isoformat()
+            self.running += 1
+
+            try:
+                job["result"] = await self.handler(job_id, **job["options"])
+                job["state"] = "ready"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} failed on worker {worker_number}: {str(e)}")
+                job["error"] = str(e)
+                job["state"] = "failed"
+            finally:
+                self.running -= 1
+                job["finished_at"] = datetime.utcnow().isoformat()
+                waiter = self.waiters.pop(job_id, None)
+                if waiter is not None and not waiter.done():
+                    waiter.set_result(job)
+                self.queue.task_done()
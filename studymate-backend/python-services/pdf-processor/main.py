@@ -1,17 +1,31 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 import fitz  # PyMuPDF
 import os
 import tempfile
 import logging
-from typing import List, Dict, Any
+import hashlib
+import shutil
+import json
+import threading
+import time
+import zlib
+from typing import List, Dict, Any, Iterator, AsyncIterator, Optional, Set
 import requests
-from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import MongoClient
-from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import MongoClient, UpdateOne
+from bson import Binary, ObjectId
 import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import defaultdict, OrderedDict
 from datetime import datetime
 
+from batch_writer import BatchWriter
+from chunker import DocumentChunker
+from jobs import JobQueue, QueueFullError
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -32,29 +46,98 @@ MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/studymate")
 client = AsyncIOMotorClient(MONGODB_URI)
 db = client.studymate
 
+# Reuse chunks of an identical, already processed upload instead of re-extracting
+DEDUPE_ENABLED = os.getenv("PDF_DEDUPE_ENABLED", "true").lower() == "true"
+
+# Chunking configuration ("chars" or "tokens" sizing). Chunks stay within one page
+# unless PDF_CHUNK_CROSS_PAGE is on; cross-page chunks record the page span they cover
+# and pageNumber is the page they start on, but they carry no pageHash
+CHUNK_UNIT = os.getenv("PDF_CHUNK_UNIT", "chars")
+CHUNK_SIZE = int(os.getenv("PDF_CHUNK_SIZE", "1000" if CHUNK_UNIT == "chars" else "256"))
+CHUNK_OVERLAP = int(os.getenv("PDF_CHUNK_OVERLAP", "200" if CHUNK_UNIT == "chars" else "48"))
+CHUNK_CROSS_PAGE = os.getenv("PDF_CHUNK_CROSS_PAGE", "false").lower() == "true"
+
+# Ingestion queue: worker count, queue depth before returning 429
+INGEST_WORKERS = int(os.getenv("PDF_INGEST_WORKERS", "2"))
+INGEST_MAX_QUEUE = int(os.getenv("PDF_INGEST_MAX_QUEUE", "100"))
+
+# OCR for image-only (scanned) pages, via PyMuPDF's Tesseract integration
+OCR_ENABLED = os.getenv("PDF_OCR_ENABLED", "true").lower() == "true"
+OCR_AVAILABLE = OCR_ENABLED and shutil.which("tesseract") is not None
+OCR_WORKERS = int(os.getenv("PDF_OCR_WORKERS", "1"))
+OCR_PAGE_TIMEOUT = float(os.getenv("PDF_OCR_PAGE_TIMEOUT", "60"))
+OCR_LANGUAGE = os.getenv("PDF_OCR_LANGUAGE", "eng")
+OCR_DPI = int(os.getenv("PDF_OCR_DPI", "300"))
+OCR_MIN_TEXT_CHARS = int(os.getenv("PDF_OCR_MIN_TEXT_CHARS", "20"))
+OCR_MIN_IMAGE_COVERAGE = float(os.getenv("PDF_OCR_MIN_IMAGE_COVERAGE", "0.3"))
+
+# Chunk records per unordered insert_many when storing a document
+WRITE_BATCH_SIZE = int(os.getenv("PDF_WRITE_BATCH_SIZE", "500"))
+
+# Compact chunk storage: "zlib" stores chunk text compressed in contentZ
+# instead of content (readers must decode it, see embedding-service)
+CHUNK_COMPRESSION = os.getenv("CHUNK_COMPRESSION", "none")
+CHUNK_COMPRESSION_LEVEL = int(os.getenv("CHUNK_COMPRESSION_LEVEL", "6"))
+
+# Open PDF handles kept for interactive page-range lookups
+EXTRACT_CACHE_SIZE = int(os.getenv("PDF_EXTRACT_CACHE_SIZE", "16"))
+EXTRACT_MAX_PAGES = int(os.getenv("PDF_EXTRACT_MAX_PAGES", "50"))
+
+# Seconds the document counts in /stats are served from cache
+STATS_CACHE_TTL = float(os.getenv("PDF_STATS_CACHE_TTL", "10"))
+
+if OCR_ENABLED and not OCR_AVAILABLE:
+    logger.warning("Tesseract not found - image-only pages will not be OCR'd")
+
 class PDFProcessor:
     def __init__(self):
-        self.chunk_size = 1000  # Characters per chunk
-        self.overlap = 200      # Character overlap between chunks
+        self.chunk_size = CHUNK_SIZE  # Characters (or tokens) per chunk
+        self.overlap = CHUNK_OVERLAP  # Overlap between chunks
+        self.chunker = DocumentChunker(
+            chunk_size=self.chunk_size,
+            overlap=self.overlap,
+            unit=CHUNK_UNIT,
+            cross_page=CHUNK_CROSS_PAGE
+        )
     
-    def extract_text_from_pdf(self, pdf_path: str) -> Dict[str, Any]:
-        """Extract text from PDF file"""
+    @staticmethod
+    def image_coverage(page) -> float:
+        """Fraction of the page area covered by images"""
+        page_area = abs(page.rect)
+        if not page_area:
+            return 0.0
+        covered = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+        return min(1.0, covered / page_area)
+    
+    def is_image_only(self, page, text: str) -> bool:
+        """Cheap scanned-page check: almost no text, and mostly covered by images"""
+        if len(text.strip()) >= OCR_MIN_TEXT_CHARS:
+            return False
+        if not page.get_images():
+            return False
+        return self.image_coverage(page) >= OCR_MIN_IMAGE_COVERAGE
+    
+    def iter_pages(self, pdf_path: str) -> Iterator[Dict[str, Any]]:
+        """Yield the text of each page, opening the PDF only once"""
+        doc = fitz.open(pdf_path)
         try:
-            doc = fitz.open(pdf_path)
-            pages_text = []
-            total_text = ""
-            
             for page_num in range(len(doc)):
                 page = doc.load_page(page_num)
                 text = page.get_text()
-                pages_text.append({
+                yield {
                     "page_number": page_num + 1,
                     "text": text,
-                    "char_count": len(text)
-                })
-                total_text += text + "\n"
-            
+                    "char_count": len(text),
+                    "image_only": self.is_image_only(page, text)
+                }
+        finally:
             doc.close()
+    
+    def extract_text_from_pdf(self, pdf_path: str) -> Dict[str, Any]:
+        """Extract text from PDF file"""
+        try:
+            pages_text = list(self.iter_pages(pdf_path))
+            total_text = "".join(page["text"] + "\n" for page in pages_text)
             
             return {
                 "success": True,
@@ -72,71 +155,257 @@ class PDFProcessor:
     
     def create_chunks(self, text: str, page_number: int = 1) -> List[Dict[str, Any]]:
         """Split text into overlapping chunks"""
-        chunks = []
-        start = 0
-        chunk_index = 0
-        
-        while start < len(text):
-            end = start + self.chunk_size
-            
-            # If this isn't the last chunk, try to break at a sentence or word boundary
-            if end < len(text):
-                # Look for sentence boundary
-                sentence_end = text.rfind('.', start, end)
-                if sentence_end > start + self.chunk_size // 2:
-                    end = sentence_end + 1
-                else:
-                    # Look for word boundary
-                    word_end = text.rfind(' ', start, end)
-                    if word_end > start + self.chunk_size // 2:
-                        end = word_end
-            
-            chunk_text = text[start:end].strip()
-            
-            if chunk_text:
-                chunks.append({
-                    "content": chunk_text,
-                    "chunk_index": chunk_index,
-                    "page_number": page_number,
-                    "start_position": start,
-                    "end_position": end,
-                    "metadata": {
-                        "word_count": len(chunk_text.split()),
-                        "character_count": len(chunk_text),
-                        "confidence": 1.0
-                    }
-                })
-                chunk_index += 1
-            
-            # Move start position with overlap
-            start = max(start + 1, end - self.overlap)
-            
-            if start >= len(text):
-                break
-        
-        return chunks
+        return self.chunker.chunk_text(text, page_number)
     
     def process_pdf_pages(self, pages_data: List[Dict]) -> List[Dict[str, Any]]:
         """Process all pages and create chunks"""
-        all_chunks = []
-        global_chunk_index = 0
+        return self.chunker.chunk_pages(pages_data)
+
+pdf_processor = PDFProcessor()
+
+# CPU-bound extraction runs in worker processes so the event loop stays responsive
+extraction_executor = ProcessPoolExecutor(
+    max_workers=INGEST_WORKERS,
+    mp_context=multiprocessing.get_context("spawn")
+)
+
+def page_hash(text: str) -> str:
+    """Content hash of a single page's extracted text"""
+    return hashlib.sha1(text.encode("utf-8", "replace")).hexdigest()
+
+def extract_and_chunk(pdf_path: str, known_page_hashes: Optional[Set[str]] = None) -> Dict[str, Any]:
+    """Extract and chunk a PDF (runs inside an extraction worker process)
+    
+    With known_page_hashes, pages are chunked one by one and pages whose hash
+    is already known are skipped; every chunk then carries its page's hash.
+    """
+    extraction_result = pdf_processor.extract_text_from_pdf(pdf_path)
+    if not extraction_result["success"]:
+        return extraction_result
+    
+    pages = extraction_result["pages"]
+    for page in pages:
+        page["page_hash"] = page_hash(page["text"])
+    
+    if known_page_hashes is None:
+        chunks = pdf_processor.process_pdf_pages(pages)
+        if not pdf_processor.chunker.cross_page:
+            hashes = {page["page_number"]: page["page_hash"] for page in pages}
+            for chunk in chunks:
+                chunk["page_hash"] = hashes[chunk["page_number"]]
+    else:
+        chunks = []
+        for page in pages:
+            if page["page_hash"] in known_page_hashes:
+                continue
+            for chunk in pdf_processor.create_chunks(page["text"], page["page_number"]):
+                chunk["page_hash"] = page["page_hash"]
+                chunks.append(chunk)
+    
+    extraction_result["chunks"] = chunks
+    # Not needed by callers; avoid pickling the text twice
+    extraction_result.pop("total_text", None)
+    return extraction_result
+
+async def run_extraction(pdf_path: str, known_page_hashes: Optional[Set[str]] = None) -> Dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(extraction_executor, extract_and_chunk, pdf_path, known_page_hashes)
+
+# OCR gets its own small pool so text pages never queue behind it
+ocr_executor = ProcessPoolExecutor(
+    max_workers=OCR_WORKERS,
+    mp_context=multiprocessing.get_context("spawn")
+) if OCR_AVAILABLE else None
+ocr_slots = asyncio.Semaphore(OCR_WORKERS)
+
+def ocr_page(pdf_path: str, page_number: int) -> str:
+    """OCR a single page (runs inside an OCR worker process)"""
+    doc = fitz.open(pdf_path)
+    try:
+        page = doc.load_page(page_number - 1)
+        textpage = page.get_textpage_ocr(language=OCR_LANGUAGE, dpi=OCR_DPI, full=True)
+        return page.get_text(textpage=textpage)
+    finally:
+        doc.close()
+
+async def ocr_pages(pdf_path: str, page_numbers: List[int]) -> Dict[int, str]:
+    """OCR pages concurrently, up to OCR_WORKERS at a time, each with a timeout
+    
+    Pages that fail or time out are left out of the result. A timed-out page
+    keeps its worker busy until Tesseract finishes, and keeps its slot until
+    then too, so the next page's timeout only starts once a worker is free.
+    """
+    loop = asyncio.get_running_loop()
+    
+    def release_slot(future):
+        ocr_slots.release()
+        if not future.cancelled():
+            future.exception()  # Nobody awaits a timed-out page's result
+    
+    async def run(page_number: int):
+        await ocr_slots.acquire()
+        future = loop.run_in_executor(ocr_executor, ocr_page, pdf_path, page_number)
+        future.add_done_callback(release_slot)
+        try:
+            # shield: a timeout stops the wait, not the worker (or its slot)
+            text = await asyncio.wait_for(asyncio.shield(future), timeout=OCR_PAGE_TIMEOUT)
+            return page_number, text
+        except asyncio.TimeoutError:
+            logger.warning(f"OCR timed out on page {page_number} after {OCR_PAGE_TIMEOUT}s")
+        except Exception as e:
+            logger.warning(f"OCR failed on page {page_number}: {str(e)}")
+        return page_number, None
+    
+    results = await asyncio.gather(*(run(page_number) for page_number in page_numbers))
+    return {page_number: text for page_number, text in results if text and text.strip()}
+
+def chunk_ocr_text(ocr_texts: Dict[int, str], first_chunk_index: int) -> List[Dict[str, Any]]:
+    """Chunk OCR'd pages one by one, numbering chunks after the text-layer ones"""
+    chunks = []
+    for page_number in sorted(ocr_texts):
+        for chunk in pdf_processor.create_chunks(ocr_texts[page_number], page_number):
+            chunk["chunk_index"] = first_chunk_index + len(chunks)
+            chunk["metadata"]["ocr"] = True
+            chunk["metadata"]["confidence"] = 0.8
+            chunks.append(chunk)
+    return chunks
+
+def stream_pdf_records(pdf_path: str, filename: str) -> Iterator[Dict[str, Any]]:
+    """Extract and chunk a PDF page by page, yielding one record per page and a summary
+    
+    The caller owns pdf_path: scanned pages listed in the summary are OCR'd from it afterwards.
+    """
+    stats = {"pages": 0, "characters": 0, "chunks": 0}
+    image_only_pages = []
+    
+    def counted_pages():
+        for page_data in pdf_processor.iter_pages(pdf_path):
+            stats["pages"] += 1
+            stats["characters"] += page_data["char_count"] + 1
+            if page_data["image_only"]:
+                image_only_pages.append(page_data["page_number"])
+            yield page_data
+    
+    try:
+        for page_number, chunks in pdf_processor.chunker.iter_page_chunks(counted_pages()):
+            stats["chunks"] += len(chunks)
+            yield {
+                "type": "page" if page_number is not None else "flush",
+                "page_number": page_number,
+                "chunks": chunks
+            }
         
-        for page_data in pages_data:
-            page_chunks = self.create_chunks(
-                page_data["text"], 
-                page_data["page_number"]
-            )
-            
-            # Update global chunk indices
-            for chunk in page_chunks:
-                chunk["chunk_index"] = global_chunk_index
-                global_chunk_index += 1
-            
-            all_chunks.extend(page_chunks)
+        yield {
+            "type": "summary",
+            "success": True,
+            "filename": filename,
+            "total_pages": stats["pages"],
+            "total_characters": stats["characters"],
+            "total_chunks": stats["chunks"],
+            "image_only_pages": image_only_pages,
+            "ocr_pages": []
+        }
+    except Exception as e:
+        logger.error(f"Error streaming PDF {filename}: {str(e)}")
+        yield {"type": "error", "success": False, "error": str(e)}
+
+async def iterate_in_thread(iterator: Iterator[Any], max_buffered: int = 8) -> AsyncIterator[Any]:
+    """Drive a blocking iterator in a worker thread, with a bounded hand-off queue"""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=max_buffered)
+    stop = threading.Event()
+    done = object()
+    
+    def put(item) -> bool:
+        # Block while the consumer is behind, but give up once it has gone away
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                future.result(timeout=1)
+                return True
+            except TimeoutError:
+                if stop.is_set():
+                    future.cancel()
+                    return False
+    
+    def produce():
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+        finally:
+            iterator.close()
+            if not stop.is_set():
+                put(done)
+    
+    producer = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+        await producer
+
+async def find_processed_duplicate(content_hash: str, document_id: ObjectId):
+    """Find another ready document with the same file content
+    
+    Documents are ready before their scanned pages are OCR'd, so sources with
+    OCR still pending (or failed) are skipped: a clone would miss those chunks.
+    """
+    return await db.documents.find_one({
+        "contentHash": content_hash,
+        "status": "ready",
+        "chunkCount": {"$gt": 0},
+        "metadata.ocrPending": {"$not": {"$gt": 0}},
+        "metadata.ocrFailed": {"$ne": True},
+        "_id": {"$ne": document_id}
+    })
+
+async def bump_chunk_generation():
+    """Mark documentchunks as changed, so the embedding service rebuilds its cached search index"""
+    await db.chunkgenerations.update_one(
+        {"_id": "documentchunks"},
+        {"$inc": {"generation": 1}},
+        upsert=True
+    )
+
+async def insert_in_batches(records: List[Dict[str, Any]]):
+    """Insert chunk records with unordered insert_many calls of at most WRITE_BATCH_SIZE"""
+    for start in range(0, len(records), WRITE_BATCH_SIZE):
+        await db.documentchunks.insert_many(records[start:start + WRITE_BATCH_SIZE], ordered=False)
+
+async def clone_document_chunks(source_id: ObjectId, target_id: ObjectId) -> int:
+    """Copy chunks (and their embeddings) of one document onto another"""
+    cloned = 0
+    batch = []
+    cursor = db.documentchunks.find({"documentId": source_id}, {"_id": 0}).sort("chunkIndex", 1)
+    
+    async for chunk in cursor:
+        chunk["documentId"] = target_id
+        chunk["createdAt"] = datetime.utcnow()
+        batch.append(chunk)
         
-        return all_chunks
+        if len(batch) >= 500:
+            await db.documentchunks.insert_many(batch)
+            cloned += len(batch)
+            batch = []
+    
+    if batch:
+        await db.documentchunks.insert_many(batch)
+        cloned += len(batch)
+    
+    return cloned
 
-pdf_processor = PDFProcessor()
+@app.on_event("startup")
+async def create_indexes():
+    """Ensure the indexes used for duplicate lookups exist"""
+    try:
+        await db.documents.create_index([("contentHash", 1), ("status", 1)])
+    except Exception as e:
+        logger.warning(f"Could not create contentHash index: {str(e)}")
 
 @app.get("/health")
 async def health_check():
@@ -148,8 +417,13 @@ async def health_check():
     }
 
 @app.post("/process-pdf")
-async def process_pdf(file: UploadFile = File(...)):
-    """Process uploaded PDF file"""
+async def process_pdf(file: UploadFile = File(...), stream: bool = False):
+    """Process uploaded PDF file
+    
+    With stream=true the response is newline-delimited JSON: one record per page
+    with the chunks completed so far, an "ocr" record with the chunks of OCR'd
+    scanned pages, then a trailing summary record.
+    """
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
     
@@ -160,17 +434,41 @@ async def process_pdf(file: UploadFile = File(...)):
             temp_file.write(content)
             temp_file_path = temp_file.name
         
-        # Extract text from PDF
-        extraction_result = pdf_processor.extract_text_from_pdf(temp_file_path)
-        
-        # Clean up temporary file
-        os.unlink(temp_file_path)
-        
-        if not extraction_result["success"]:
-            raise HTTPException(status_code=500, detail=extraction_result["error"])
+        if stream:
+            async def ndjson():
+                try:
+                    async for record in iterate_in_thread(stream_pdf_records(temp_file_path, file.filename)):
+                        if record["type"] == "summary" and record["image_only_pages"] and OCR_AVAILABLE:
+                            # Scanned pages have no text layer; OCR them in the separate pool
+                            ocr_texts = await ocr_pages(temp_file_path, record["image_only_pages"])
+                            ocr_chunks = chunk_ocr_text(ocr_texts, record["total_chunks"])
+                            yield json.dumps({"type": "ocr", "page_number": None, "chunks": ocr_chunks}) + "\n"
+                            record["total_chunks"] += len(ocr_chunks)
+                            record["ocr_pages"] = sorted(ocr_texts)
+                        yield json.dumps(record) + "\n"
+                finally:
+                    os.unlink(temp_file_path)
+            
+            return StreamingResponse(ndjson(), media_type="application/x-ndjson")
         
-        # Create chunks from extracted text
-        chunks = pdf_processor.process_pdf_pages(extraction_result["pages"])
+        try:
+            # Extract text and create chunks off the event loop
+            extraction_result = await run_extraction(temp_file_path)
+            
+            if not extraction_result["success"]:
+                raise HTTPException(status_code=500, detail=extraction_result["error"])
+            
+            chunks = extraction_result["chunks"]
+            
+            # Scanned pages have no text layer; OCR them in the separate pool
+            image_only_pages = [page["page_number"] for page in extraction_result["pages"] if page["image_only"]]
+            ocr_texts = {}
+            if image_only_pages and OCR_AVAILABLE:
+                ocr_texts = await ocr_pages(temp_file_path, image_only_pages)
+                chunks = chunks + chunk_ocr_text(ocr_texts, len(chunks))
+        finally:
+            # Clean up temporary file
+            os.unlink(temp_file_path)
         
         return {
             "success": True,
@@ -179,6 +477,8 @@ async def process_pdf(file: UploadFile = File(...)):
             "total_characters": extraction_result["total_characters"],
             "total_chunks": len(chunks),
             "chunks": chunks,
+            "image_only_pages": image_only_pages,
+            "ocr_pages": sorted(ocr_texts),
             "processing_time": "calculated_by_caller"
         }
     
@@ -186,57 +486,398 @@ async def process_pdf(file: UploadFile = File(...)):
         logger.error(f"Error processing PDF: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
 
-@app.post("/process-document/{document_id}")
-async def process_document_by_id(document_id: str):
-    """Process document by MongoDB document ID"""
+def build_chunk_document(document_id: ObjectId, chunk: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape a chunk from the chunker as a documentchunks record"""
+    chunk_doc = {
+        "documentId": document_id,
+        "chunkIndex": chunk["chunk_index"],
+        "pageNumber": chunk["page_number"],
+        "startPosition": chunk["start_position"],
+        "endPosition": chunk["end_position"],
+        "metadata": chunk["metadata"],
+        "createdAt": datetime.utcnow()
+    }
+    if CHUNK_COMPRESSION == "zlib":
+        chunk_doc["contentZ"] = Binary(zlib.compress(chunk["content"].encode("utf-8"), CHUNK_COMPRESSION_LEVEL))
+        chunk_doc["contentEncoding"] = "zlib"
+    else:
+        chunk_doc["content"] = chunk["content"]
+    if "page_hash" in chunk:
+        chunk_doc["pageHash"] = chunk["page_hash"]
+    return chunk_doc
+
+# Blocking client, created lazily inside extraction worker processes
+_sync_db = None
+
+def get_sync_db():
+    global _sync_db
+    if _sync_db is None:
+        _sync_db = MongoClient(MONGODB_URI).studymate
+    return _sync_db
+
+def extract_and_store_chunks(pdf_path: str, document_id: str) -> Dict[str, Any]:
+    """Extract, chunk and store a document's chunks (runs inside an extraction worker process)
+    
+    Chunks go to a BatchWriter as each page is chunked, so batched writes
+    overlap with extraction of the next pages and the whole chunk list is
+    never held in memory.
+    """
+    stats = {"pages": 0, "characters": 0, "chunks": 0}
+    image_only_pages = []
+    page_hashes = {}
+    
+    def pages():
+        for page_data in pdf_processor.iter_pages(pdf_path):
+            stats["pages"] += 1
+            stats["characters"] += page_data["char_count"] + 1
+            page_hashes[page_data["page_number"]] = page_hash(page_data["text"])
+            if page_data["image_only"]:
+                image_only_pages.append(page_data["page_number"])
+            yield page_data
+    
+    try:
+        writer = BatchWriter(get_sync_db().documentchunks, WRITE_BATCH_SIZE)
+        try:
+            for _, chunks in pdf_processor.chunker.iter_page_chunks(pages()):
+                for chunk in chunks:
+                    if not pdf_processor.chunker.cross_page:
+                        chunk["page_hash"] = page_hashes[chunk["page_number"]]
+                    writer.add(build_chunk_document(ObjectId(document_id), chunk))
+                    stats["chunks"] += 1
+        except Exception:
+            try:
+                writer.close()
+            except Exception:
+                pass
+            raise
+        write_stats = writer.close()
+        
+        return {
+            "success": True,
+            "total_pages": stats["pages"],
+            "total_characters": stats["characters"],
+            "total_chunks": stats["chunks"],
+            "image_only_pages": image_only_pages,
+            "write_stats": write_stats
+        }
+    except Exception as e:
+        logger.error(f"Error storing chunks for {document_id}: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+# Cumulative chunk write statistics, reported by /stats
+write_metrics = {"documents": 0, "chunks": 0, "batches": 0, "seconds": 0.0}
+
+def record_write_stats(document_id: str, write_stats: Dict[str, Any]):
+    write_metrics["documents"] += 1
+    write_metrics["chunks"] += write_stats["records"]
+    write_metrics["batches"] += write_stats["batches"]
+    write_metrics["seconds"] += write_stats["seconds"]
+    logger.info(
+        f"Stored {write_stats['records']} chunks for {document_id} in {write_stats['batches']} batches "
+        f"({write_stats['seconds']}s, {write_stats['records_per_second']} chunks/s)"
+    )
+
+async def reprocess_changed_pages(document_id: ObjectId, temp_file_path: str) -> Dict[str, Any]:
+    """Re-chunk only pages whose content changed since the last run
+    
+    Existing chunks are grouped by the hash of the page they came from. Pages
+    whose hash still occurs keep their chunks (and embeddings), renumbered to
+    the page's new position; chunks of pages that no longer occur are deleted.
+    Chunks without a page hash (cross-page chunks from a run with
+    PDF_CHUNK_CROSS_PAGE on) can't be matched and are replaced, so the first
+    diff after switching back to per-page chunks re-chunks every page.
+    """
+    existing = await db.documentchunks.find(
+        {"documentId": document_id},
+        {"_id": 1, "pageHash": 1, "pageNumber": 1, "chunkIndex": 1}
+    ).sort("chunkIndex", 1).to_list(None)
+    
+    # page hash -> list of old pages with that content, each a list of chunk records
+    old_pages = defaultdict(list)
+    unmatched_ids = []
+    pages_seen = {}
+    for chunk in existing:
+        if not chunk.get("pageHash"):
+            unmatched_ids.append(chunk["_id"])
+            continue
+        key = (chunk["pageNumber"], chunk["pageHash"])
+        if key not in pages_seen:
+            pages_seen[key] = []
+            old_pages[chunk["pageHash"]].append(pages_seen[key])
+        pages_seen[key].append(chunk)
+    
+    extraction_result = await run_extraction(temp_file_path, set(old_pages))
+    if not extraction_result["success"]:
+        raise RuntimeError(extraction_result["error"])
+    
+    new_chunks_by_page = defaultdict(list)
+    for chunk in extraction_result["chunks"]:
+        new_chunks_by_page[chunk["page_number"]].append(chunk)
+    
+    updates = []
+    inserts = []
+    chunk_index = 0
+    unchanged_pages = 0
+    
+    for page in extraction_result["pages"]:
+        matches = old_pages.get(page["page_hash"])
+        if matches:
+            unchanged_pages += 1
+            for chunk in matches.pop(0):
+                if chunk["pageNumber"] != page["page_number"] or chunk["chunkIndex"] != chunk_index:
+                    updates.append(UpdateOne(
+                        {"_id": chunk["_id"]},
+                        {"$set": {
+                            "pageNumber": page["page_number"],
+                            "chunkIndex": chunk_index,
+                            "metadata.page_start": page["page_number"],
+                            "metadata.page_end": page["page_number"]
+                        }}
+                    ))
+                chunk_index += 1
+            continue
+        
+        page_chunks = new_chunks_by_page.get(page["page_number"])
+        if page_chunks is None and page["page_hash"] in old_pages:
+            # Repeated page whose old copies are all used up: chunk it here
+            page_chunks = pdf_processor.create_chunks(page["text"], page["page_number"])
+        
+        for chunk in page_chunks or []:
+            chunk["chunk_index"] = chunk_index
+            chunk["page_hash"] = page["page_hash"]
+            inserts.append(build_chunk_document(document_id, chunk))
+            chunk_index += 1
+    
+    # Whatever old pages were not matched have been removed or changed
+    stale_ids = unmatched_ids + [
+        chunk["_id"]
+        for groups in old_pages.values()
+        for group in groups
+        for chunk in group
+    ]
+    
+    try:
+        if stale_ids:
+            await db.documentchunks.delete_many({"_id": {"$in": stale_ids}})
+        if updates:
+            await db.documentchunks.bulk_write(updates, ordered=False)
+        if inserts:
+            await insert_in_batches(inserts)
+    finally:
+        if stale_ids or inserts:
+            await bump_chunk_generation()
+    
+    return {
+        "total_pages": extraction_result["total_pages"],
+        "total_chunks": chunk_index,
+        "unchanged_pages": unchanged_pages,
+        "changed_pages": extraction_result["total_pages"] - unchanged_pages,
+        "chunks_added": len(inserts),
+        "chunks_deleted": len(stale_ids),
+        "image_only_pages": [page["page_number"] for page in extraction_result["pages"] if page["image_only"]]
+    }
+
+ocr_tasks = set()
+
+async def ocr_document_pages(document_id: ObjectId, pdf_path: str, page_numbers: List[int], first_chunk_index: int):
+    """OCR image-only pages and add their chunks to an already ready document"""
+    try:
+        ocr_texts = await ocr_pages(pdf_path, page_numbers)
+        chunks = chunk_ocr_text(ocr_texts, first_chunk_index)
+        
+        if chunks:
+            try:
+                await insert_in_batches([build_chunk_document(document_id, chunk) for chunk in chunks])
+            except Exception:
+                # Don't leave the OCR batches written before the failure behind
+                await db.documentchunks.delete_many({"documentId": document_id, "metadata.ocr": True})
+                raise
+            finally:
+                await bump_chunk_generation()
+        
+        await db.documents.update_one(
+            {"_id": document_id},
+            {
+                "$inc": {"chunkCount": len(chunks)},
+                "$set": {"metadata.ocrPages": len(ocr_texts)},
+                "$unset": {"metadata.ocrPending": ""}
+            }
+        )
+        
+        logger.info(f"OCR added {len(chunks)} chunks from {len(ocr_texts)}/{len(page_numbers)} pages of {document_id}")
+    except Exception as e:
+        logger.error(f"OCR of document {document_id} failed: {str(e)}")
+        try:
+            await db.documents.update_one(
+                {"_id": document_id},
+                {"$set": {"metadata.ocrFailed": True}, "$unset": {"metadata.ocrPending": ""}}
+            )
+        except Exception as e:
+            logger.error(f"Could not record OCR failure of {document_id}: {str(e)}")
+    finally:
+        os.unlink(pdf_path)
+
+async def schedule_ocr(document_id: ObjectId, pdf_path: str, page_numbers: List[int], first_chunk_index: int) -> bool:
+    """Start background OCR of image-only pages, which then owns pdf_path
+    
+    metadata.ocrPending is recorded before the task starts, so the task's own
+    clear can't be overwritten. Returns False (and removes the file) when
+    there is nothing to OCR.
+    """
+    if not page_numbers or not OCR_AVAILABLE:
+        os.unlink(pdf_path)
+        await db.documents.update_one(
+            {"_id": document_id},
+            {"$unset": {"metadata.ocrPending": "", "metadata.ocrFailed": ""}}
+        )
+        return False
+    
+    try:
+        await db.documents.update_one(
+            {"_id": document_id},
+            {"$set": {"metadata.ocrPending": len(page_numbers)}, "$unset": {"metadata.ocrFailed": ""}}
+        )
+    except Exception:
+        os.unlink(pdf_path)
+        raise
+    
+    task = asyncio.create_task(ocr_document_pages(document_id, pdf_path, page_numbers, first_chunk_index))
+    ocr_tasks.add(task)
+    task.add_done_callback(ocr_tasks.discard)
+    return True
+
+async def process_document(document_id: str, mode: str = "full") -> Dict[str, Any]:
+    """Extract, chunk and store a document from GridFS (ingestion job handler)
+    
+    mode="diff" only re-chunks pages that changed since the document was last processed.
+    """
     try:
         # Get document from MongoDB
         document = await db.documents.find_one({"_id": ObjectId(document_id)})
         if not document:
-            raise HTTPException(status_code=404, detail="Document not found")
+            raise ValueError("Document not found")
         
         # Get file from GridFS
-        fs = AsyncIOMotorGridFS(db, collection="uploads")
+        fs = AsyncIOMotorGridFSBucket(db, bucket_name="uploads")
         file_data = await fs.open_download_stream(document["fileId"])
         
-        # Save to temporary file
+        # Save to temporary file, hashing the content on the way
+        hasher = hashlib.sha256()
         with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            async for chunk in file_data:
+            while True:
+                chunk = await file_data.readchunk()
+                if not chunk:
+                    break
+                hasher.update(chunk)
                 temp_file.write(chunk)
             temp_file_path = temp_file.name
         
-        # Process PDF
-        extraction_result = pdf_processor.extract_text_from_pdf(temp_file_path)
-        os.unlink(temp_file_path)
+        content_hash = hasher.hexdigest()
+        await db.documents.update_one(
+            {"_id": ObjectId(document_id)},
+            {"$set": {"contentHash": content_hash}}
+        )
+        
+        # Identical file already processed: clone its chunks and embeddings
+        if DEDUPE_ENABLED:
+            source = await find_processed_duplicate(content_hash, ObjectId(document_id))
+            if source:
+                os.unlink(temp_file_path)
+                try:
+                    await db.documentchunks.delete_many({"documentId": ObjectId(document_id)})
+                    cloned = await clone_document_chunks(source["_id"], ObjectId(document_id))
+                finally:
+                    await bump_chunk_generation()
+                
+                await db.documents.update_one(
+                    {"_id": ObjectId(document_id)},
+                    {
+                        "$set": {
+                            "status": "ready",
+                            "chunkCount": cloned,
+                            "metadata.pages": source.get("metadata", {}).get("pages", 0),
+                            "metadata.extractedText": True,
+                            "metadata.processingTime": 0,
+                            "metadata.dedupedFrom": source["_id"]
+                        },
+                        "$unset": {"metadata.ocrPending": "", "metadata.ocrFailed": ""}
+                    }
+                )
+                
+                logger.info(f"Document {document_id} deduplicated from {source['_id']} ({cloned} chunks)")
+                
+                return {
+                    "success": True,
+                    "document_id": document_id,
+                    "total_pages": source.get("metadata", {}).get("pages", 0),
+                    "total_chunks": cloned,
+                    "deduplicated_from": str(source["_id"]),
+                    "message": "Document processed successfully"
+                }
         
-        if not extraction_result["success"]:
-            # Mark document as failed
+        if mode == "diff":
+            try:
+                diff = await reprocess_changed_pages(ObjectId(document_id), temp_file_path)
+            except Exception:
+                os.unlink(temp_file_path)
+                raise
+            
+            # Text pages are ready now; scanned pages are OCR'd in the background
+            ocr_pending = await schedule_ocr(
+                ObjectId(document_id), temp_file_path, diff["image_only_pages"], diff["total_chunks"]
+            )
+            
             await db.documents.update_one(
                 {"_id": ObjectId(document_id)},
-                {"$set": {"status": "failed"}}
+                {
+                    "$set": {
+                        "status": "ready",
+                        "chunkCount": diff["total_chunks"],
+                        "metadata.pages": diff["total_pages"],
+                        "metadata.extractedText": True
+                    }
+                }
+            )
+            
+            logger.info(
+                f"Document {document_id} diff: {diff['changed_pages']} changed pages, "
+                f"+{diff['chunks_added']}/-{diff['chunks_deleted']} chunks"
             )
-            raise HTTPException(status_code=500, detail=extraction_result["error"])
+            
+            return {
+                "success": True,
+                "document_id": document_id,
+                **diff,
+                "ocr_pending": ocr_pending,
+                "message": "Document processed successfully"
+            }
         
-        # Create chunks
-        chunks = pdf_processor.process_pdf_pages(extraction_result["pages"])
+        # Process PDF: replace any chunks from an earlier run, then extract and
+        # store the new ones in batches inside an extraction worker
+        try:
+            await db.documentchunks.delete_many({"documentId": ObjectId(document_id)})
+            
+            loop = asyncio.get_running_loop()
+            extraction_result = await loop.run_in_executor(
+                extraction_executor, extract_and_store_chunks, temp_file_path, document_id
+            )
+            if not extraction_result["success"]:
+                raise RuntimeError(extraction_result["error"])
+        except Exception:
+            os.unlink(temp_file_path)
+            # Don't leave the batches written before the failure behind
+            await db.documentchunks.delete_many({"documentId": ObjectId(document_id)})
+            raise
+        finally:
+            # Old chunks are gone (and some new ones may be written) either way
+            await bump_chunk_generation()
         
-        # Save chunks to MongoDB
-        chunk_documents = []
-        for chunk in chunks:
-            chunk_doc = {
-                "documentId": ObjectId(document_id),
-                "content": chunk["content"],
-                "chunkIndex": chunk["chunk_index"],
-                "pageNumber": chunk["page_number"],
-                "startPosition": chunk["start_position"],
-                "endPosition": chunk["end_position"],
-                "metadata": chunk["metadata"],
-                "createdAt": datetime.utcnow()
-            }
-            chunk_documents.append(chunk_doc)
+        record_write_stats(document_id, extraction_result["write_stats"])
+        total_chunks = extraction_result["total_chunks"]
         
-        if chunk_documents:
-            await db.documentchunks.insert_many(chunk_documents)
+        # Text pages are ready now; scanned pages are OCR'd in the background
+        image_only_pages = extraction_result["image_only_pages"]
+        ocr_pending = await schedule_ocr(ObjectId(document_id), temp_file_path, image_only_pages, total_chunks)
         
         # Update document status
         await db.documents.update_one(
@@ -244,7 +885,7 @@ async def process_document_by_id(document_id: str):
             {
                 "$set": {
                     "status": "ready",
-                    "chunkCount": len(chunks),
+                    "chunkCount": total_chunks,
                     "metadata.pages": extraction_result["total_pages"],
                     "metadata.extractedText": True,
                     "metadata.processingTime": 0  # Would be calculated in real implementation
@@ -256,7 +897,10 @@ async def process_document_by_id(document_id: str):
             "success": True,
             "document_id": document_id,
             "total_pages": extraction_result["total_pages"],
-            "total_chunks": len(chunks),
+            "total_chunks": total_chunks,
+            "write_stats": extraction_result["write_stats"],
+            "image_only_pages": image_only_pages,
+            "ocr_pending": ocr_pending,
             "message": "Document processed successfully"
         }
     
@@ -270,22 +914,234 @@ async def process_document_by_id(document_id: str):
             )
         except:
             pass
+        raise
+
+ingestion_queue = JobQueue(process_document, workers=INGEST_WORKERS, max_depth=INGEST_MAX_QUEUE)
+
+@app.on_event("startup")
+async def start_ingestion_queue():
+    ingestion_queue.start()
+
+@app.on_event("shutdown")
+async def stop_ingestion_queue():
+    await ingestion_queue.stop()
+    extraction_executor.shutdown(wait=False, cancel_futures=True)
+    if ocr_executor is not None:
+        ocr_executor.shutdown(wait=False, cancel_futures=True)
+    page_executor.shutdown(wait=False, cancel_futures=True)
+
+@app.post("/process-document/{document_id}")
+async def process_document_by_id(document_id: str, wait: bool = False, mode: str = "full"):
+    """Queue a document for processing by MongoDB document ID
+    
+    mode=diff re-processes only the pages that changed since the last run.
+    """
+    if not ObjectId.is_valid(document_id):
+        raise HTTPException(status_code=400, detail="Invalid document ID")
+    if mode not in ("full", "diff"):
+        raise HTTPException(status_code=400, detail="mode must be 'full' or 'diff'")
+    if mode == "diff" and CHUNK_CROSS_PAGE:
+        # Cross-page chunks carry no page hash, so a diff could only replace them all
+        raise HTTPException(status_code=400, detail="mode=diff needs per-page chunks (PDF_CHUNK_CROSS_PAGE=false)")
+    
+    document = await db.documents.find_one(
+        {"_id": ObjectId(document_id)},
+        {"status": 1, "metadata.fileSize": 1}
+    )
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    # Small documents first, so a single large book doesn't hold up everyone else
+    try:
+        job = ingestion_queue.submit(
+            document_id,
+            priority=document.get("metadata", {}).get("fileSize", 0),
+            options={"mode": mode}
+        )
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    
+    if document.get("status") != "processing":
+        await db.documents.update_one(
+            {"_id": ObjectId(document_id)},
+            {"$set": {"status": "processing"}}
+        )
+    
+    if wait:
+        job = await ingestion_queue.wait(document_id)
+        if job["state"] == "failed":
+            raise HTTPException(status_code=500, detail=job["error"])
+        return job["result"]
+    
+    return JSONResponse(status_code=202, content={
+        "success": True,
+        "document_id": document_id,
+        "job_id": job["job_id"],
+        "state": job["state"],
+        "queue": ingestion_queue.stats()
+    })
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get the status of an ingestion job"""
+    job = ingestion_queue.get(job_id)
+    if job:
+        return {**job, "queue": ingestion_queue.stats()}
+    
+    # Not (or no longer) tracked in memory: fall back to the document status
+    if not ObjectId.is_valid(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    document = await db.documents.find_one({"_id": ObjectId(job_id)}, {"status": 1, "chunkCount": 1})
+    if not document:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return {
+        "job_id": job_id,
+        "state": document.get("status", "processing"),
+        "result": {"total_chunks": document.get("chunkCount", 0)} if document.get("status") == "ready" else None,
+        "queue": ingestion_queue.stats()
+    }
+
+# MuPDF documents aren't thread-safe, so all page-range work runs on one thread
+page_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-pages")
+
+class DocumentHandleCache:
+    """LRU of open fitz.Document handles, keyed by GridFS file ID"""
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.handles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: str):
+        doc = self.handles.get(key)
+        if doc is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.handles.move_to_end(key)
+        return doc
+    
+    def put(self, key: str, doc):
+        """Cache a handle, returning the one to use (an existing one wins a race)"""
+        existing = self.handles.get(key)
+        if existing is not None:
+            page_executor.submit(doc.close)
+            return existing
+        
+        self.handles[key] = doc
+        while len(self.handles) > self.max_size:
+            _, evicted = self.handles.popitem(last=False)
+            # Closed on the page thread, after any read still using it
+            page_executor.submit(evicted.close)
+        return doc
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"open_documents": len(self.handles), "hits": self.hits, "misses": self.misses}
+
+handle_cache = DocumentHandleCache(EXTRACT_CACHE_SIZE)
+
+def read_page_range(doc, start_page: int, end_page: int) -> Dict[str, Any]:
+    """Extract text from only the requested pages of an open document
+    
+    Runs on the page thread like every other use of a handle, page count
+    included; end_page is clamped to the document's length.
+    """
+    total_pages = len(doc)
+    end_page = min(end_page, total_pages)
+    pages = []
+    for page_num in range(start_page - 1, end_page):
+        text = doc.load_page(page_num).get_text()
+        pages.append({
+            "page_number": page_num + 1,
+            "text": text,
+            "char_count": len(text)
+        })
+    return {"total_pages": total_pages, "end_page": end_page, "pages": pages}
+
+@app.get("/extract/{document_id}")
+async def extract_page_range(document_id: str, start_page: int = 1, end_page: Optional[int] = None):
+    """Extract the text of a page range without processing the whole document"""
+    if not ObjectId.is_valid(document_id):
+        raise HTTPException(status_code=400, detail="Invalid document ID")
+    
+    end_page = end_page or start_page
+    if start_page < 1 or end_page < start_page:
+        raise HTTPException(status_code=400, detail="Invalid page range")
+    if end_page - start_page + 1 > EXTRACT_MAX_PAGES:
+        raise HTTPException(status_code=400, detail=f"At most {EXTRACT_MAX_PAGES} pages per request")
+    
+    try:
+        document = await db.documents.find_one({"_id": ObjectId(document_id)}, {"fileId": 1})
+        if not document:
+            raise HTTPException(status_code=404, detail="Document not found")
+        
+        loop = asyncio.get_running_loop()
+        cache_key = str(document["fileId"])
+        doc = handle_cache.get(cache_key)
+        
+        if doc is None:
+            fs = AsyncIOMotorGridFSBucket(db, bucket_name="uploads")
+            file_data = await fs.open_download_stream(document["fileId"])
+            content = await file_data.read()
+            doc = await loop.run_in_executor(
+                page_executor, lambda: fitz.open(stream=content, filetype="pdf")
+            )
+            doc = handle_cache.put(cache_key, doc)
+        
+        page_range = await loop.run_in_executor(page_executor, read_page_range, doc, start_page, end_page)
+        if start_page > page_range["total_pages"]:
+            raise HTTPException(status_code=416, detail=f"Document has {page_range['total_pages']} pages")
+        
+        return {
+            "success": True,
+            "document_id": document_id,
+            "total_pages": page_range["total_pages"],
+            "start_page": start_page,
+            "end_page": page_range["end_page"],
+            "pages": page_range["pages"]
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error extracting pages from {document_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Document counts by status, refreshed at most once per STATS_CACHE_TTL
+stats_cache = {"counts": None, "expires": 0.0}
+stats_lock = asyncio.Lock()
+
+async def document_counts() -> Dict[str, int]:
+    """Count documents by status with one aggregation, cached for a short TTL"""
+    async with stats_lock:
+        # Concurrent pollers wait here and share a single refresh
+        if stats_cache["counts"] is None or time.monotonic() >= stats_cache["expires"]:
+            by_status = await db.documents.aggregate([
+                {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+            ]).to_list(None)
+            counts = {row["_id"]: row["count"] for row in by_status}
+            stats_cache["counts"] = {
+                "total_documents": sum(counts.values()),
+                "processing": counts.get("processing", 0),
+                "ready": counts.get("ready", 0),
+                "failed": counts.get("failed", 0)
+            }
+            stats_cache["expires"] = time.monotonic() + STATS_CACHE_TTL
+        return stats_cache["counts"]
+
 @app.get("/stats")
 async def get_stats():
     """Get processing statistics"""
     try:
-        total_documents = await db.documents.count_documents({})
-        processing_documents = await db.documents.count_documents({"status": "processing"})
-        ready_documents = await db.documents.count_documents({"status": "ready"})
-        failed_documents = await db.documents.count_documents({"status": "failed"})
-        
         return {
-            "total_documents": total_documents,
-            "processing": processing_documents,
-            "ready": ready_documents,
-            "failed": failed_documents,
+            **await document_counts(),
+            "extract_cache": handle_cache.stats(),
+            "chunk_writes": {
+                **write_metrics,
+                "chunks_per_second": round(write_metrics["chunks"] / write_metrics["seconds"], 1) if write_metrics["seconds"] else 0.0
+            },
             "service_status": "running"
         }
     except Exception as e:
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Semantic answer cache for the StudyMate chat servers
+Remembers answers by the embedding of the question they answered, so a
+near-identical question about the same documents is served from memory
+instead of another retrieval and LLM round trip.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Numbers and quoted terms change what a question asks without moving its embedding much
+KEY_TERM_PATTERN = re.compile(r'"([^"]+)"|“([^”]+)”|(\d+(?:[.,]\d+)*)')
+
+def key_terms(question: str) -> List[str]:
+    """The numbers and quoted terms of a question, which a cached answer's question must share exactly"""
+    return [next(group for group in match.groups() if group).strip().lower() for match in KEY_TERM_PATTERN.finditer(question)]
+
+def normalize(vector: List[float]) -> List[float]:
+    norm = sum(value * value for value in vector) ** 0.5
+    return [value / norm for value in vector] if norm else list(vector)
+
+class SemanticCache:
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600, threshold: float = 0.92):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        # entry id -> entry, oldest use first; scopes index the ids per scope
+        self.entries = OrderedDict()
+        self.scopes = {}
+        self.next_id = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _drop(self, entry_id: int):
+        entry = self.entries.pop(entry_id)
+        ids = self.scopes[entry["scope"]]
+        ids.discard(entry_id)
+        if not ids:
+            del self.scopes[entry["scope"]]
+
+    def _similarities(self, vector: List[float], candidates: List[Dict[str, Any]]) -> List[float]:
+        if np is not None:
+            return (np.asarray([entry["vector"] for entry in candidates]) @ np.asarray(vector)).tolist()
+        return [sum(a * b for a, b in zip(entry["vector"], vector)) for entry in candidates]
+
+    def lookup(self, scope: str, vector: List[float]) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Closest live answer in scope above the similarity threshold, with its similarity"""
+        vector = normalize(vector)
+        now = time.time()
+        with self.lock:
+            candidates = []
+            for entry_id in list(self.scopes.get(scope, ())):
+                entry = self.entries[entry_id]
+                if now - entry["created"] > self.ttl:
+                    self._drop(entry_id)
+                    self.expired += 1
+                else:
+                    candidates.append(entry)
+
+            best, best_similarity = None, self.threshold
+            if candidates:
+                for entry, similarity in zip(candidates, self._similarities(vector, candidates)):
+                    if similarity >= best_similarity:
+                        best, best_similarity = entry, similarity
+
+            if best is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best["id"])
+            best["hits"] += 1
+            self.hits += 1
+            return best, best_similarity
+
+    def store(self, scope: str, vector: List[float], question: str, answer: Dict[str, Any]):
+        with self.lock:
+            entry_id = self.next_id
+            self.next_id += 1
+            self.entries[entry_id] = {
+                "id": entry_id,
+                "scope": scope,
+                "vector": normalize(vector),
+                "question": question,
+                "answer": answer,
+                "created": time.time(),
+                "hits": 0
+            }
+            self.scopes.setdefault(scope, set()).add(entry_id)
+            while len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)))
+                self.evicted += 1
+
+    def clear(self, scope_prefix: str = "") -> int:
+        """Forget every answer whose scope starts with scope_prefix, returning how many"""
+        with self.lock:
+            stale = [entry_id for scope, ids in self.scopes.items() if scope.startswith(scope_prefix) for entry_id in ids]
+            for entry_id in stale:
+                self._drop(entry_id)
+            return len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "scopes": len(self.scopes),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "expired": self.expired,
+                "evicted": self.evicted
+            }
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test fused PDF ingestion of scanned pages
+A page with no text layer must be OCR'd and end up in documentchunks
+"""
+
+import asyncio
+import importlib.util
+import os
+import sys
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+SERVICES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "python-services")
+SCANNED_TEXT = "Photosynthesis turns light into chemical energy in the chloroplasts. " * 4
+
+def load_service(name: str, directory: str):
+    """Import a service's main.py under its own module name (both are called main)"""
+    path = os.path.join(SERVICES, directory)
+    sys.path.insert(0, path)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(path, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class FakeModel:
+    """Stands in for the sentence-transformers model, which the test doesn't need"""
+    def __init__(self, name: str):
+        pass
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return 8
+
+    def encode(self, texts, **kwargs):
+        import numpy as np
+        return np.ones((len(texts), 8), dtype="float32")
+
+def make_pdf() -> bytes:
+    """A text page followed by a scanned page (a full-page image, no text layer)"""
+    import fitz
+    doc = fitz.open()
+    doc.new_page().insert_textbox(fitz.Rect(50, 50, 550, 800), "Cells divide by mitosis. " * 40, fontsize=9)
+    page = doc.new_page()
+    pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 64), False)
+    pixmap.clear_with(200)
+    page.insert_image(page.rect, pixmap=pixmap)
+    return doc.tobytes()
+
+def test_scanned_page_is_ingested(monkeypatch):
+    """/ingest-pdf stores the OCR'd text of a scanned page next to the text-layer chunks"""
+    sentence_transformers = pytest.importorskip("sentence_transformers")
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    pytest.importorskip("fitz")
+    import httpx
+
+    monkeypatch.setattr(sentence_transformers, "SentenceTransformer", FakeModel)
+    processor = load_service("pdf_processor_main", "pdf-processor")
+    embedding = load_service("embedding_service_main", "embedding-service")
+
+    db = mongomock_motor.AsyncMongoMockClient().studymate
+    monkeypatch.setattr(processor, "db", db)
+    monkeypatch.setattr(embedding, "db", db)
+
+    # Tesseract isn't needed either: OCR returns fixed text on a thread
+    monkeypatch.setattr(processor, "OCR_AVAILABLE", True)
+    monkeypatch.setattr(processor, "ocr_executor", ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(processor, "ocr_page", lambda pdf_path, page_number: SCANNED_TEXT)
+
+    # The embedding service reaches the PDF processor in-process
+    processor_transport = httpx.ASGITransport(app=processor.app)
+    monkeypatch.setattr(embedding, "httpx", types.SimpleNamespace(
+        AsyncClient=lambda **kwargs: httpx.AsyncClient(transport=processor_transport, **kwargs)
+    ))
+
+    async def ingest():
+        transport = httpx.ASGITransport(app=embedding.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://embedding") as http:
+            response = await http.post(
+                "/ingest-pdf",
+                files={"file": ("scanned.pdf", make_pdf(), "application/pdf")}
+            )
+        assert response.status_code == 200, response.text
+        result = response.json()
+        chunks = await db.documentchunks.find({"documentId": embedding.ObjectId(result["document_id"])}).to_list(None)
+        return result, chunks
+
+    result, chunks = asyncio.run(ingest())
+    scanned = [chunk for chunk in chunks if chunk["pageNumber"] == 2]
+    print(f"📊 {len(chunks)} chunks stored, {len(scanned)} from the scanned page, OCR'd pages {result['ocr_pages']}")
+
+    assert result["ocr_pages"] == [2]
+    assert result["total_chunks"] == len(chunks)
+    assert scanned and all(chunk["metadata"]["ocr"] for chunk in scanned)
+    assert "Photosynthesis" in scanned[0]["content"]
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-q", "-s"])
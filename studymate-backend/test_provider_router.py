@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Test provider routing in the All-Models Server
+A provider that fails fast must not outrank a slower healthy one
+"""
+
+import importlib.util
+import os
+
+def load_server():
+    """Import all-models-server.py (the hyphenated name rules out a plain import)"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "all-models-server.py")
+    spec = importlib.util.spec_from_file_location("all_models_server", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_flaky_provider_does_not_outrank_healthy():
+    """A provider failing every other call in 40ms loses to a healthy one taking 1.5s"""
+    server = load_server()
+    router = server.ProviderRouter(
+        alpha=0.3, failure_threshold=3, open_seconds=30, error_penalty=4,
+        failure_latencies={"flaky": 30.0, "healthy": 30.0}
+    )
+
+    calls = {"flaky": 0, "healthy": 0}
+    flaky_first = 0
+    for _ in range(40):
+        order = router.order(["flaky", "healthy"])
+        flaky_first += order[0] == "flaky"
+
+        # Like the server: try providers in order until one succeeds
+        for provider in order:
+            router.begin(provider)
+            calls[provider] += 1
+            if provider == "flaky" and calls[provider] % 2 == 1:
+                router.record_failure(provider, 0.04)
+                router.end(provider)
+                continue
+            router.record_success(provider, 0.04 if provider == "flaky" else 1.5)
+            router.end(provider)
+            break
+
+    scores = {provider: router.score(provider) for provider in calls}
+    print(f"📊 flaky routed first in {flaky_first}/40 requests, scores {scores}")
+
+    assert scores["healthy"] < scores["flaky"]
+    assert flaky_first <= 4
+
+if __name__ == "__main__":
+    test_flaky_provider_does_not_outrank_healthy()
+    print("✅ Provider routing test passed")
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Token accounting for the StudyMate AI servers
+Counts prompt and completion tokens with each model's own tokenizer, loaded
+once in the background and cached, and remembers the counts of recently seen
+texts (system prompts, document context chunks) so repeats cost a hash lookup.
+"""
+
+import hashlib
+import importlib.util
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from typing import List, Dict, Any
+
+# transformers is imported when the first tokenizer loads, not with this module
+TRANSFORMERS_AVAILABLE = importlib.util.find_spec("transformers") is not None
+
+logger = logging.getLogger(__name__)
+
+# Chat formats add a few tokens per message for role markers and separators
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 2
+
+class TokenCounter:
+    def __init__(self, tokenizer_names: Dict[str, str], cache_size: int = 4096):
+        """tokenizer_names maps a model label to the Hugging Face tokenizer to load for it"""
+        self.tokenizer_names = tokenizer_names
+        self.cache_size = cache_size
+        self.tokenizers = {}
+        self.loading = set()
+        self.lock = threading.Lock()
+        self.counts = OrderedDict()
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.usage = defaultdict(lambda: {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "estimated": 0})
+
+    def register(self, model: str, tokenizer):
+        """Use an already loaded tokenizer for a model"""
+        with self.lock:
+            self.tokenizers[model] = tokenizer
+
+    def _load(self, model: str, name: str):
+        try:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(name)
+            logger.info(f"Loaded tokenizer {name} for {model}")
+        except Exception as e:
+            logger.warning(f"Tokenizer {name} for {model} unavailable, estimating tokens: {e}")
+            tokenizer = None
+        with self.lock:
+            self.tokenizers[model] = tokenizer
+            self.loading.discard(model)
+
+    def get_tokenizer(self, model: str):
+        """The model's tokenizer, or None while it loads (or if it can't be loaded)"""
+        with self.lock:
+            if model in self.tokenizers:
+                return self.tokenizers[model]
+            name = self.tokenizer_names.get(model)
+            if not TRANSFORMERS_AVAILABLE or not name or model in self.loading:
+                return None
+            self.loading.add(model)
+
+        # Load off the request path; requests are estimated until it is ready
+        threading.Thread(target=self._load, args=(model, name), name=f"tokenizer-{model}", daemon=True).start()
+        return None
+
+    def count_text(self, model: str, text: str) -> Dict[str, Any]:
+        """Token count of one text, and whether it was estimated"""
+        tokenizer = self.get_tokenizer(model)
+        if tokenizer is None:
+            # Roughly four characters per token for English text
+            return {"tokens": max(1, round(len(text) / 4)) if text else 0, "estimated": True}
+
+        key = (model, hashlib.sha1(text.encode("utf-8", "replace")).digest())
+        with self.lock:
+            tokens = self.counts.get(key)
+            if tokens is not None:
+                self.counts.move_to_end(key)
+                self.cache_hits += 1
+                return {"tokens": tokens, "estimated": False}
+            self.cache_misses += 1
+
+        tokens = len(tokenizer.encode(text, add_special_tokens=False))
+        with self.lock:
+            self.counts[key] = tokens
+            while len(self.counts) > self.cache_size:
+                self.counts.popitem(last=False)
+        return {"tokens": tokens, "estimated": False}
+
+    def count_messages(self, model: str, messages: List[Dict]) -> Dict[str, Any]:
+        """Prompt tokens of a chat request, each message counted (and cached) separately"""
+        total = TOKENS_PER_REPLY
+        estimated = False
+        for message in messages:
+            result = self.count_text(model, str(message.get("content", "")))
+            total += result["tokens"] + TOKENS_PER_MESSAGE
+            estimated = estimated or result["estimated"]
+        return {"tokens": total, "estimated": estimated}
+
+    def usage_for(self, model: str, messages: List[Dict], completion: str) -> Dict[str, Any]:
+        """OpenAI-style usage block for a request, also added to the running totals"""
+        prompt = self.count_messages(model, messages)
+        reply = self.count_text(model, completion)
+        estimated = prompt["estimated"] or reply["estimated"]
+
+        with self.lock:
+            totals = self.usage[model]
+            totals["requests"] += 1
+            totals["prompt_tokens"] += prompt["tokens"]
+            totals["completion_tokens"] += reply["tokens"]
+            if estimated:
+                totals["estimated"] += 1
+
+        usage = {
+            "prompt_tokens": prompt["tokens"],
+            "completion_tokens": reply["tokens"],
+            "total_tokens": prompt["tokens"] + reply["tokens"]
+        }
+        if estimated:
+            usage["estimated"] = True
+        return usage
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                "tokenizers": {model: tokenizer is not None for model, tokenizer in self.tokenizers.items()},
+                "count_cache_entries": len(self.counts),
+                "count_cache_hit_ratio": round(self.cache_hits / lookups, 4) if lookups else 0.0,
+                "usage": {model: dict(totals) for model, totals in self.usage.items()}
+            }
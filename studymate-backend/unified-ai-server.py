@@ -6,7 +6,7 @@ Compatible with OpenAI API format for easy integration
 """
 
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 import os
 import json
@@ -14,12 +14,17 @@ import time
 import logging
 import tempfile
 import shutil
+import threading
+import hashlib
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 import uuid
 import requests
 from dotenv import load_dotenv
 
+from token_counter import TokenCounter
+from semantic_cache import SemanticCache, key_terms
+
 
 # Load environment variables
 import os
@@ -120,6 +125,56 @@ chunk_store = {}
 EMBEDDING_SERVICE_URL = os.getenv('EMBEDDING_SERVICE_URL', 'http://localhost:5002')
 PDF_PROCESSOR_URL = os.getenv('PDF_PROCESSOR_URL', 'http://localhost:5001')
 
+# Seconds /api/documents reuses the PDF processor's last stats response
+DOCUMENT_STATS_TTL = float(os.getenv('DOCUMENT_STATS_TTL', '5'))
+document_stats_cache = {"stats": None, "expires": 0.0}
+document_stats_lock = threading.Lock()
+
+# Tokenizers used for the usage block, loaded in the background on first use
+token_counter = TokenCounter({
+    "deepseek-chat": os.getenv('DEEPSEEK_TOKENIZER', 'deepseek-ai/DeepSeek-V3'),
+    CHAT_MODEL: CHAT_MODEL
+}, int(os.getenv('TOKEN_COUNT_CACHE_SIZE', '4096')))
+
+def token_model():
+    """Tokenizer label for the active chat backend"""
+    return "deepseek-chat" if chat_model == "deepseek_api" else CHAT_MODEL
+
+# Document context packing: candidates fetched from the embedding service, the
+# token budget they are packed into (best first) and the minimum similarity kept
+CONTEXT_SEARCH_LIMIT = int(os.getenv('CONTEXT_SEARCH_LIMIT', '8'))
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1500'))
+CONTEXT_MIN_SCORE = float(os.getenv('CONTEXT_MIN_SCORE', '0.25'))
+# A chunk that doesn't fit is cut down only if at least this many tokens remain
+CONTEXT_MIN_CHUNK_TOKENS = int(os.getenv('CONTEXT_MIN_CHUNK_TOKENS', '64'))
+
+# Semantic answer cache: a question whose embedding is this close to one already
+# answered for the same documents and conversation, with the same numbers and
+# quoted terms, gets the earlier answer. Off unless enabled.
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'false').lower() == 'true'
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.92'))
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '3600'))
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '1000'))
+# Seconds to wait for the embedding service on a cache lookup before skipping the cache
+ANSWER_CACHE_EMBED_TIMEOUT = float(os.getenv('ANSWER_CACHE_EMBED_TIMEOUT', '0.3'))
+# Chunk changes made anywhere (uploads here, the PDF processor, deletions through the API)
+# move the embedding service's chunk generation; cached answers are dropped when it does,
+# checked at most this often, so a change elsewhere is seen within this many seconds
+ANSWER_CACHE_GENERATION_INTERVAL = float(os.getenv('ANSWER_CACHE_GENERATION_INTERVAL', '5'))
+answer_cache = SemanticCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_THRESHOLD)
+answer_cache_generation = {"generation": None, "checked": 0.0, "lock": threading.Lock()}
+
+# Replies the generators return in place of an answer; these are never cached
+FAILED_REPLY_PREFIXES = (
+    "I apologize, but I'm having trouble",
+    "Authentication failed",
+    "Rate limit exceeded",
+    "Access forbidden",
+    "API error (status",
+    "The AI service is taking too long",
+    "Error:"
+)
+
 # Ensure directories exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(VECTOR_DB_PATH, exist_ok=True)
@@ -146,6 +201,7 @@ def initialize_models():
         logger.info(f"✅ API URL: {HUGGINGFACE_API_URL}")
         chat_model = "huggingface_api"
         chat_tokenizer = AutoTokenizer.from_pretrained(CHAT_MODEL)
+        token_counter.register(CHAT_MODEL, chat_tokenizer)
     else:
         logger.warning("❌ No API keys provided for DeepSeek or Hugging Face")
         chat_model = None
@@ -213,13 +269,112 @@ def generate_deepseek_response(messages, max_tokens=512, temperature=0.7):
         logger.error(f"Error calling DeepSeek API: {e}")
         return "I apologize, but I'm having trouble connecting to the AI service."
 
-def search_document_context(query: str, limit: int = 3) -> List[Dict[str, Any]]:
+def stream_deepseek_response(messages, max_tokens=512, temperature=0.7):
+    """Yield content deltas from a streamed DeepSeek chat completion"""
+    headers = {
+        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    
+    payload = {
+        "model": "deepseek-chat",
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "stream": True
+    }
+    
+    with requests.post(DEEPSEEK_API_URL, headers=headers, json=payload, timeout=30, stream=True) as response:
+        if response.status_code != 200:
+            raise Exception(f"DeepSeek API error: {response.status_code} - {response.text}")
+        
+        # Event streams are always UTF-8; without a charset requests would assume ISO-8859-1
+        response.encoding = "utf-8"
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            choices = json.loads(data).get("choices") or [{}]
+            delta = choices[0].get("delta", {}).get("content")
+            if delta:
+                yield delta
+
+def sse_chat_stream(messages, context_chunks, cached_reply=None, on_complete=None):
+    """Stream the reply as OpenAI chat.completion.chunk server-sent events"""
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    started = time.monotonic()
+    
+    def event(delta, finish_reason=None, usage=None):
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": CHAT_MODEL,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            "context_used": len(context_chunks) > 0,
+            "context_chunks": len(context_chunks),
+            "cached": cached_reply is not None
+        }
+        if usage is not None:
+            chunk["usage"] = usage
+        return f"data: {json.dumps(chunk)}\n\n"
+    
+    yield event({"role": "assistant", "content": ""})
+    
+    first_token = None
+    completion = []
+    failed = False
+    if cached_reply is not None:
+        completion.append(cached_reply)
+        yield event({"content": cached_reply})
+    elif chat_model == "deepseek_api":
+        try:
+            for delta in stream_deepseek_response(messages):
+                if first_token is None:
+                    first_token = time.monotonic() - started
+                    logger.info(f"Time to first token (DeepSeek): {first_token:.3f}s")
+                completion.append(delta)
+                yield event({"content": delta})
+        except Exception as e:
+            logger.error(f"Error streaming from DeepSeek API: {e}")
+            failed = True
+            if first_token is None:
+                completion.append("I apologize, but I'm having trouble connecting to the AI service.")
+                yield event({"content": completion[-1]})
+    else:
+        # No token streaming upstream: send the whole reply as one chunk
+        if chat_model == "huggingface_api":
+            response_text = generate_huggingface_response(messages)
+        else:
+            response_text = "Error: No AI model configured"
+        first_token = time.monotonic() - started
+        logger.info(f"Time to first token (single chunk): {first_token:.3f}s")
+        completion.append(response_text)
+        yield event({"content": response_text})
+    
+    logger.info(f"Stream finished in {time.monotonic() - started:.3f}s")
+    # Usage rides on the final chunk, as with OpenAI's include_usage
+    if cached_reply is not None:
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    else:
+        usage = token_counter.usage_for(token_model(), messages, "".join(completion))
+        if on_complete is not None and not failed:
+            on_complete("".join(completion))
+    yield event({}, "stop", usage)
+    yield "data: [DONE]\n\n"
+
+def search_document_context(query: str, limit: int = 3, document_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
     """Search for relevant document chunks using embedding service"""
     try:
         search_payload = {
             "query": query,
             "limit": limit
         }
+        if document_ids:
+            search_payload["document_ids"] = document_ids
         
         response = requests.post(
             f"{EMBEDDING_SERVICE_URL}/search-similar",
@@ -243,6 +398,160 @@ def search_document_context(query: str, limit: int = 3) -> List[Dict[str, Any]]:
         logger.error(f"Error searching document context: {e}")
         return []
 
+def overlap_length(earlier: str, later: str, probe: int = 64) -> int:
+    """Characters at the end of earlier repeated at the start of later (sliding-window chunk overlap)"""
+    head = later[:probe]
+    if len(head) < probe:
+        return 0
+    start = earlier.find(head)
+    while start != -1:
+        if later.startswith(earlier[start:]):
+            return len(earlier) - start
+        start = earlier.find(head, start + 1)
+    return 0
+
+def truncate_to_tokens(text: str, tokens: int, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, preferring to end on a sentence"""
+    cut = text[:int(len(text) * max_tokens / tokens)]
+    sentence_end = cut.rfind(". ")
+    if sentence_end > len(cut) // 2:
+        cut = cut[:sentence_end + 1]
+    return cut.rstrip() + " …"
+
+def pack_context(context_chunks: List[Dict], budget: int = CONTEXT_TOKEN_BUDGET,
+                 min_score: float = CONTEXT_MIN_SCORE) -> List[Dict]:
+    """Fill the token budget with the most relevant chunks, skipping weak matches and repeated text"""
+    model = token_model()
+    ranked = sorted(context_chunks, key=lambda chunk: chunk.get('similarity_score', 0.0), reverse=True)
+    
+    packed = []
+    seen = set()
+    used = 0
+    for chunk in ranked:
+        if chunk.get('similarity_score', 0.0) < min_score:
+            break
+        text = chunk.get('content', '').strip()
+        if not text or text in seen:
+            continue
+        
+        # Neighbouring chunks of the same document share their overlap window
+        neighbours = [
+            other for other in packed
+            if other.get('document_id') == chunk.get('document_id')
+            and abs(other.get('chunk_index', 0) - chunk.get('chunk_index', 0)) == 1
+        ]
+        for other in neighbours:
+            if other['chunk_index'] < chunk['chunk_index']:
+                text = text[overlap_length(other['content'], text):].lstrip()
+            else:
+                text = text[:len(text) - overlap_length(text, other['content'])].rstrip()
+        if not text or any(text in other['content'] for other in packed):
+            continue
+        
+        tokens = token_counter.count_text(model, text)["tokens"]
+        remaining = budget - used
+        if tokens > remaining:
+            if remaining < CONTEXT_MIN_CHUNK_TOKENS:
+                break
+            text = truncate_to_tokens(text, tokens, remaining)
+            tokens = remaining
+        
+        seen.add(chunk.get('content', '').strip())
+        packed.append({**chunk, "content": text})
+        used += tokens
+        if used >= budget:
+            break
+    
+    logger.info(f"Packed {len(packed)} of {len(context_chunks)} context chunks into ~{used}/{budget} tokens")
+    return packed
+
+def embed_query(text: str) -> Optional[List[float]]:
+    """Embedding of a question, from the local model or the embedding service"""
+    try:
+        if embedding_model is not None:
+            return embedding_model.encode([text])[0].tolist()
+        
+        response = requests.post(
+            f"{EMBEDDING_SERVICE_URL}/generate-embeddings",
+            json={"texts": [text]},
+            timeout=ANSWER_CACHE_EMBED_TIMEOUT
+        )
+        response.raise_for_status()
+        return response.json()["embeddings"][0]
+    except requests.Timeout:
+        logger.warning(f"Embedding the question took over {ANSWER_CACHE_EMBED_TIMEOUT}s, skipping the answer cache")
+        return None
+    except Exception as e:
+        logger.error(f"Error embedding question for the answer cache: {e}")
+        return None
+
+def refresh_answer_cache_generation():
+    """Drop every cached answer once documentchunks has changed, whichever service changed it"""
+    state = answer_cache_generation
+    with state["lock"]:
+        if time.monotonic() - state["checked"] < ANSWER_CACHE_GENERATION_INTERVAL:
+            return
+        state["checked"] = time.monotonic()
+        try:
+            response = requests.get(f"{EMBEDDING_SERVICE_URL}/chunk-generation", timeout=ANSWER_CACHE_EMBED_TIMEOUT)
+            response.raise_for_status()
+            generation = response.json()["generation"]
+        except Exception as e:
+            # Entries then stay until the next successful check or their TTL
+            logger.warning(f"Could not check the chunk generation for the answer cache: {e}")
+            return
+        
+        if generation != state["generation"]:
+            dropped = answer_cache.clear()
+            if dropped:
+                logger.info(f"Chunks changed (generation {generation}), dropped {dropped} cached answers")
+            state["generation"] = generation
+
+def answer_cache_scope(messages: List[Dict], document_ids: Optional[List[str]], use_context: bool) -> str:
+    """Answers are only shared between requests with the same documents, earlier turns and model,
+    and questions with the same numbers and quoted terms ("page 42" never gets the answer for "page 43")
+    """
+    scope = json.dumps({
+        "model": token_model(),
+        "context": use_context,
+        "history": messages[:-1],
+        "key_terms": key_terms(messages[-1]['content'])
+    }, sort_keys=True)
+    # Answers over all documents go stale when a new one is uploaded
+    if use_context and not document_ids:
+        return "all:" + hashlib.sha256(scope.encode()).hexdigest()
+    return "docs:" + hashlib.sha256((scope + json.dumps(sorted(document_ids or []))).encode()).hexdigest()
+
+def cached_completion(entry: Dict[str, Any], similarity: float, stream: bool):
+    """Serve a cached answer in the same shape as a generated one"""
+    answer = entry["answer"]
+    if stream:
+        return Response(
+            stream_with_context(sse_chat_stream([], answer["context_chunks"], cached_reply=answer["content"])),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    
+    return jsonify({
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": CHAT_MODEL,
+        "choices": [{
+            "index": 0,
+            "message": {
+                "role": "assistant",
+                "content": answer["content"]
+            },
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        "context_used": len(answer["context_chunks"]) > 0,
+        "context_chunks": len(answer["context_chunks"]),
+        "cached": True,
+        "cache_similarity": round(similarity, 4)
+    })
+
 def inject_document_context(messages: List[Dict], context_chunks: List[Dict]) -> List[Dict]:
     """Inject document context into the conversation messages"""
     if not context_chunks:
@@ -326,19 +635,31 @@ def chat_completions():
     messages = data.get('messages', [])
     stream = data.get('stream', False)
     use_context = data.get('use_context', True)  # Enable context by default
-
-    # For now, we don't support streaming
-    if stream:
-        return jsonify({"error": "Streaming not supported"}), 400
+    use_cache = ANSWER_CACHE_ENABLED and data.get('cache', True)  # "cache": false bypasses the answer cache
+    document_ids = data.get('document_ids')
 
     # Get user query for context search
     user_query = messages[-1]['content'] if messages else ""
     
+    # Near-identical questions about the same documents reuse an earlier answer
+    cache_scope = None
+    query_vector = None
+    if use_cache and user_query:
+        refresh_answer_cache_generation()
+        query_vector = embed_query(user_query)
+        if query_vector is not None:
+            cache_scope = answer_cache_scope(messages, document_ids, use_context)
+            hit = answer_cache.lookup(cache_scope, query_vector)
+            if hit is not None:
+                entry, similarity = hit
+                logger.info(f"Answer cache hit ({similarity:.3f}) for query: {user_query[:100]}")
+                return cached_completion(entry, similarity, stream)
+    
     # Search for relevant document context if enabled
     context_chunks = []
     if use_context and user_query:
         logger.info(f"Searching document context for query: {user_query[:100]}...")
-        context_chunks = search_document_context(user_query, limit=3)
+        context_chunks = pack_context(search_document_context(user_query, limit=CONTEXT_SEARCH_LIMIT, document_ids=document_ids))
         
         if context_chunks:
             logger.info(f"Using {len(context_chunks)} document chunks for context")
@@ -347,6 +668,21 @@ def chat_completions():
         else:
             logger.info("No relevant document context found, using general AI response")
 
+    def remember_answer(reply: str):
+        if cache_scope is not None and reply and not reply.startswith(FAILED_REPLY_PREFIXES):
+            sources = [
+                {"chunk_id": chunk.get("chunk_id"), "document_id": chunk.get("document_id"), "page_number": chunk.get("page_number")}
+                for chunk in context_chunks
+            ]
+            answer_cache.store(cache_scope, query_vector, user_query, {"content": reply, "context_chunks": sources})
+
+    if stream:
+        return Response(
+            stream_with_context(sse_chat_stream(messages, context_chunks, on_complete=remember_answer)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
     # Generate response
     if chat_model == "deepseek_api":
         response_text = generate_deepseek_response(messages)
@@ -354,6 +690,7 @@ def chat_completions():
         response_text = generate_huggingface_response(messages)
     else:
         response_text = "Error: No AI model configured"
+    remember_answer(response_text)
 
     # Format response in OpenAI-like format
     return jsonify({
@@ -369,13 +706,10 @@ def chat_completions():
             },
             "finish_reason": "stop"
         }],
-        "usage": {
-            "prompt_tokens": 0,  # TODO: calculate
-            "completion_tokens": 0,
-            "total_tokens": 0
-        },
+        "usage": token_counter.usage_for(token_model(), messages, response_text),
         "context_used": len(context_chunks) > 0,
-        "context_chunks": len(context_chunks)
+        "context_chunks": len(context_chunks),
+        "cached": False
     })
 
 @app.route('/api/upload', methods=['POST'])
@@ -392,44 +726,44 @@ def upload_document():
         if not file.filename.lower().endswith('.pdf'):
             return jsonify({"error": "Only PDF files are supported"}), 400
         
-        # Forward to PDF processor service
+        # Create the document record first, so its chunks can be listed and deleted
+        file.stream.seek(0, os.SEEK_END)
+        file_size = file.stream.tell()
+        file.stream.seek(0)
+        record = requests.post(
+            f"{EMBEDDING_SERVICE_URL}/documents",
+            json={"filename": file.filename, "file_size": file_size},
+            timeout=10
+        )
+        record.raise_for_status()
+        document_id = record.json()["document_id"]
+
+        # Forward to the embedding service's fused ingestion pipeline, which streams
+        # chunks from the PDF processor, embeds them and stores the vectors
         files = {'file': (file.filename, file.stream, file.content_type)}
         response = requests.post(
-            f"{PDF_PROCESSOR_URL}/process-pdf",
+            f"{EMBEDDING_SERVICE_URL}/ingest-pdf",
+            params={"document_id": document_id},
             files=files,
-            timeout=60
+            timeout=300
         )
         
         if response.status_code == 200:
             result = response.json()
-            logger.info(f"PDF processed: {result['total_chunks']} chunks created")
-            
-            # Generate embeddings for the chunks
-            embedding_response = requests.post(
-                f"{EMBEDDING_SERVICE_URL}/generate-embeddings",
-                json={"texts": [chunk["content"] for chunk in result["chunks"]]},
-                timeout=60
-            )
-            
-            if embedding_response.status_code == 200:
-                logger.info("Embeddings generated successfully")
-                return jsonify({
-                    "success": True,
-                    "filename": result["filename"],
-                    "total_chunks": result["total_chunks"],
-                    "message": "Document uploaded and processed successfully"
-                })
-            else:
-                logger.error(f"Embedding generation failed: {embedding_response.status_code}")
-                return jsonify({
-                    "success": True,
-                    "filename": result["filename"],
-                    "total_chunks": result["total_chunks"],
-                    "message": "Document uploaded but embedding generation failed"
-                })
+            logger.info(f"PDF ingested: {result['total_chunks']} chunks embedded in {result['processing_time_ms']} ms")
+            dropped = answer_cache.clear("all:")
+            if dropped:
+                logger.info(f"Dropped {dropped} cached answers over all documents")
+            return jsonify({
+                "success": True,
+                "filename": result["filename"],
+                "document_id": result["document_id"],
+                "total_chunks": result["total_chunks"],
+                "message": "Document uploaded and processed successfully"
+            })
         else:
-            logger.error(f"PDF processing failed: {response.status_code}")
-            return jsonify({"error": "Failed to process PDF"}), 500
+            logger.error(f"PDF ingestion failed: {response.status_code} - {response.text}")
+            return jsonify({"error": "Failed to process PDF", "document_id": document_id}), 500
             
     except Exception as e:
         logger.error(f"Upload error: {e}")
@@ -439,12 +773,15 @@ def upload_document():
 def list_documents():
     """List all uploaded documents"""
     try:
-        # Get stats from PDF processor
-        response = requests.get(f"{PDF_PROCESSOR_URL}/stats", timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return jsonify({"error": "Failed to get document stats"}), 500
+        # Get stats from PDF processor, at most once per DOCUMENT_STATS_TTL
+        with document_stats_lock:
+            if document_stats_cache["stats"] is None or time.monotonic() >= document_stats_cache["expires"]:
+                response = requests.get(f"{PDF_PROCESSOR_URL}/stats", timeout=10)
+                if response.status_code != 200:
+                    return jsonify({"error": "Failed to get document stats"}), 500
+                document_stats_cache["stats"] = response.json()
+                document_stats_cache["expires"] = time.monotonic() + DOCUMENT_STATS_TTL
+            return jsonify(document_stats_cache["stats"])
     except Exception as e:
         logger.error(f"Error listing documents: {e}")
         return jsonify({"error": str(e)}), 500
@@ -507,6 +844,11 @@ def health_check():
     except Exception as e:
         return jsonify({"status": "unhealthy", "error": str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Token accounting and answer cache statistics for this server"""
+    return jsonify({"tokens": token_counter.stats(), "answer_cache": answer_cache.stats()})
+
 if __name__ == '__main__':
     initialize_models()
     app.run(host='0.0.0.0', port=5000, debug=True)